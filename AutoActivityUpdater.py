@@ -1,32 +1,46 @@
 import traceback
 from argparse import ArgumentParser
-
-from selenium.webdriver import Keys
+from time import time
 
 from DriverUtils import *
-
-import pyautogui
+from WorkerPool import *
+from ProgressJournal import *
+from RetryPolicy import *
+from LinkStore import *
+from ChangePlan import *
+from FixupCache import *
+from FingerprintStore import *
+from CorpusIndex import CorpusIndex, find_pow_candidates
 
 # updates the model without closing the robot menu
-def update_model(driver, robot : WebElement, index : int, model):
-    robot_button = robot.find_element(By.TAG_NAME, "button")
+def update_model(driver, robot : WebElement, index : int, model, robot_button : WebElement | None = None):
+    if robot_button is None: robot_button = robot.find_element(By.TAG_NAME, "button")
     robot_button.click()
 
     wait_for_vis(driver, "robotModel" + str(index + 1), by_val=By.ID).click()  # open model selection
     goto_and_click(driver, "//img[@value=\'" + model + "\']", By.XPATH)  # select model
     wait_for_vis(driver, "closeButton", by_val=By.ID).click()  # close the menu
 
-def try_fixup(driver : WebDriver, link, is_lesson, model):
-    robots = get_robots(driver)
-    if robots is None or len(robots) < 1: return
+# sets every robot index in assignments to its model in one go, going through the dialog of any robot which did not
+# take its model that way one click at a time
+def apply_models(driver : WebDriver, assignments : dict[int, str]):
+    unchanged = set_robot_models(driver, assignments)
+    if len(unchanged) == 0: return
+
+    print("Setting robots " + str([index + 1 for index in unchanged]) + " one at a time")
+    robots = get_robot_inventory(driver)
+    for index in unchanged:
+        update_model(driver, robots[index].element, index, assignments[index], robots[index].button)
+        print("Finished robot " + str(index + 1))
 
-    models = []
-    for robot in robots:
-        robot_button = robot.find_element(By.TAG_NAME, "button")
-        robot_model = robot_button.find_element(By.TAG_NAME, "img").get_attribute("src")
-        models.append(robot_model[34 : len(robot_model) - 4])  # exclude .png from model name
+# compares the start block models against the first example (or solution) not already open, without changing
+# anything. Returns the fixup outcome (None if there are no robots) and the model each start block robot should be set
+# back to
+def inspect_fixup(driver : WebDriver, link) -> tuple[str | None, dict[int, str]]:
+    robots = get_robots(driver)
+    if robots is None or len(robots) < 1: return None, {}
 
-    error_filename = "PotentialOverwrites.txt"
+    models = get_robot_models(driver)
 
     source = get_if_exists(driver, "//button[contains(@id, 'loadExample') and not(contains(@class, 'active'))]", By.XPATH)
     if source is None:
@@ -34,24 +48,18 @@ def try_fixup(driver : WebDriver, link, is_lesson, model):
 
     if source is None:
         print("No source found for fixup; ending fixup attempt.")
-        write_to_file(error_filename, "NO SOURCE: " + link + "\n")
-        return
+        return fixup_no_source, {}
 
     ensure_in_view(driver, source)
     source.click()
     robots = get_robots(driver)
-    if robots is None or len(robots) < 1: return
+    if robots is None or len(robots) < 1: return None, {}
 
     if len(robots) != len(models):
         print("Model count mismatch between target and source; ending fixup attempt.")
-        write_to_file(error_filename, "MODEL COUNT MISMATCH: " + link + " - " + driver.title + "\n")
-        return
+        return fixup_model_count_mismatch, {}
 
-    source_models = []
-    for robot in robots:
-        robot_button = robot.find_element(By.TAG_NAME, "button")
-        robot_model = robot_button.find_element(By.TAG_NAME, "img").get_attribute("src")
-        source_models.append(robot_model[34: len(robot_model) - 4])
+    source_models = get_robot_models(driver)
 
     print("Found original models: " + str(models) + " and source models: " + str(source_models))
 
@@ -63,64 +71,108 @@ def try_fixup(driver : WebDriver, link, is_lesson, model):
 
     if not has_non_linkbot:
         print("No fix is needed in fixup attempt.")
-        write_to_file(error_filename, "NO FIX APPLIED: " + link + " - " + driver.title + "\n")
-        return
+        return fixup_no_fix, {}
+
+    assignments : dict[int, str] = {}
+    for i in range(0, len(models)):
+        if source_models[i] == "Linkbot": continue  # these models should have been changed
+        if models[i] == source_models[i]: continue  # agreement means this was done correctly
+        assignments[i] = source_models[i]
+
+    if len(assignments) == 0:
+        print("Start blocks already agree with the source in fixup attempt.")
+        return fixup_no_fix, {}
+
+    return fixup_applied, assignments
+
+# the fixup outcomes of this run and earlier ones, if they are being kept
+fixup_cache : FixupCache | None = None
+
+# the index of every workspace the run reads, if one is being kept
+corpus_index : CorpusIndex | None = None
+
+# adds the workspace xml of a link's sub-target to the corpus index, never failing the link over it
+def index_workspace(link, descriptor : str, xml_text : str | None):
+    if corpus_index is None or xml_text is None: return
+    try:
+        corpus_index.add(get_export_file_name(link, descriptor), xml_text)
+    except Exception as error:
+        print("Could not add the workspace to the corpus index: ", error)
+
+def record_fixup(link, status : str, title : str):
+    if fixup_cache is not None: fixup_cache.add(link, status, title)
+    else: write_to_file("PotentialOverwrites.txt", get_fixup_note(link, status, title))
+
+# tries the robot model fixup on the start blocks, returning whether a fix was saved
+def try_fixup(driver : WebDriver, link, is_lesson) -> bool:
+    status, assignments = inspect_fixup(driver, link)
+    title = driver.title
+    if status is None: return False
+    if status != fixup_applied:
+        record_fixup(link, status, title)
+        return False
 
     print("A fix will be applied in the current fixup attempt.")
-    write_to_file(error_filename, "APPLIED FIX(es): " + link + " - " + driver.title + "\n")
 
     open_and_ignore_prompt(driver, link)  # go back to original start blocks
-    robots = get_robots(driver)
-    for i in range(0, len(models)):
-        if source_models[i] == "Linkbot": continue  # these models should have been changed
-        if model[i] == source_models[i]: continue  # agreement means this was done correctly
-        update_model(driver, robots[i], i, source_models[i])
+    get_robots(driver)  # opens the robot menu
+    apply_models(driver, assignments)
 
     wait_for_vis(driver, "robotCollapseButton", by_val=By.ID).click()  # close menu
     save_activity(driver, is_lesson)
+    record_fixup(link, status, title)  # only once the fix has been saved
 
-    return  # we do not need to redo start blocks
+    return True  # we do not need to redo start blocks
 
 def update_models(driver, link, info : list[str]):
     print("Beginning processing of: " + link)
     model = info[len(info) - 1]  # last info is always model
     link_info : LinkInfo = LinkInfo(info[0])
 
-    # open the link
-    open_and_ignore_prompt(driver, link)
+    # open the link, unless an earlier entry of this activity already did
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
 
     # extract info
     is_lesson = link_info.is_lesson()  # if this is lesson or activity
     is_example = link_info.is_example()  # if this is example or solution/start blocks
     target_num = link_info.get_num_str()  # if this is start blocks (None) or what number to target
 
-    print("Trying fixup")
+    # the fixup covers the whole activity, so it only needs to be tried on its first entry, and not at all if an earlier
+    # run already tried it
+    cached_fixup = fixup_cache.get(link) if fixup_cache is not None else None
+    if cached_fixup is not None and not session.fixup_done:
+        print("Fixup was already tried on this activity: " + cached_fixup["status"])
+        session.fixup_done = True
 
-    # try to fix start blocks, since we have iterated over all of them already
-    try_fixup(driver, link, is_lesson, model)  # try to fix all the start blocks
+    fixed = False  # whether the fixup saved anything, which makes the link changed even if its robots need nothing
+    if not session.fixup_done:
+        print("Trying fixup")
+        session.select_target(False, None)  # the fixup starts from the start blocks
 
-    print("Finished trying fixup")
-    print("Beginning with is_example: " + str(is_example) + ", target_num: " + str(target_num))
-
-    open_and_ignore_prompt(driver, link)  # we need to reset page after fixup attempt
+        # try to fix start blocks, since we have iterated over all of them already
+        fixed = try_fixup(driver, link, is_lesson)  # try to fix all the start blocks
+        session.fixup_done = True
 
-    select_target_type(driver, is_example, target_num)  # opens example or solution of correct num if relevant
+        print("Finished trying fixup")
+        session.invalidate()
+        session.open(link)  # we need to reset page after fixup attempt
 
-    robots = get_robots(driver)
-    if robots is None: return
+    print("Beginning with is_example: " + str(is_example) + ", target_num: " + str(target_num))
 
-    # set the models
-    for index in range(0, len(robots)):
-        print("Beginning on robot " + str(index + 1) + "/" + str(len(robots)))
-        robot = robots[index]  # they should be in order
+    session.select_target(is_example, target_num)  # opens example or solution of correct num if relevant
 
-        robot_model = robot.find_element(By.TAG_NAME, "button").find_element(By.TAG_NAME, "img").get_attribute("src")
-        if robot_model[34 : len(robot_model) - 4] != "Linkbot": continue  # don't update non linkbot models
+    if get_robots(driver) is None: return outcome_success if fixed else outcome_no_op
+    robots = get_robot_inventory(driver)
 
-        update_model(driver, robot, index, model)
-        print("Finished robot " + str(index + 1))
+    # set the models, leaving non linkbot models alone
+    assignments = {robot.index: model for robot in robots if robot.model == "Linkbot"}
+    if len(assignments) == 0:
+        print("No robots need updating; skipping the save.")
+        return outcome_success if fixed else outcome_no_op
 
-        # last line of robot processing
+    print("Updating " + str(len(assignments)) + "/" + str(len(robots)) + " robots")
+    apply_models(driver, assignments)
 
     # close the robot menu
     print("Finished processing all robots; preparing to save.")
@@ -132,17 +184,12 @@ def update_models(driver, link, info : list[str]):
     # we don't bother manually closing since its far more consistent to just navigate to the next page
     print("Finished: " + link)
 
-def is_draw_replace(expression : str) -> bool:
-    return expression == "draw_expr"
-
 def replace_pow_xml(driver : WebDriver, link , info : list[str]):
-    # open the link
-    open_and_ignore_prompt(driver, link)
+    # open the link, unless an earlier entry of this activity already did
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
 
     target_expression: str = info[len(info) - 1]
-    is_draw : bool = is_draw_replace(target_expression)
-    target_name = "expr"
-    if is_draw: target_name = "VALUE_4"
 
     link_info: LinkInfo = LinkInfo(info[0])
     is_lesson = link_info.is_lesson()
@@ -150,10 +197,9 @@ def replace_pow_xml(driver : WebDriver, link , info : list[str]):
     target_num = link_info.get_num_str()
     has_board = link_info.is_pre() or link_info.is_post()  # neither board should be on for start blocks
 
-    select_target_type(driver, is_example, target_num)  # open example or solution
+    session.select_target(is_example, target_num)  # open example or solution
 
     # will open the correct board, or none of that is appropriate
-    was_min_view = False
     board_type = None
     board_index : int = 1
     if has_board:
@@ -163,70 +209,49 @@ def replace_pow_xml(driver : WebDriver, link , info : list[str]):
         else:
             board_type = "PostBoard"
             board_index = 3
-        was_min_view = open_board(driver, link_info.is_pre())
+        session.open_board(link_info.is_pre())
 
     title = driver.title
 
-    # download the activity and get details about the downloaded file
-    download_activity(driver, board_index)
-    file_name = get_top_download(driver).shadow_root.find_element(By.ID, "name").get_attribute("title")
-    file_location = append_cur_dir("Downloads", file_name)
+    # read the workspace straight from the page, which leaves the page as it is so it can be loaded into after
+    file_name = get_export_file_name(link, info[0])
+    xml_text = export_workspace_xml(driver, board_index)
+    needs_reload = xml_text is None
+    if needs_reload:
+        # fall back to downloading the activity, which navigates away from it
+        print("Could not read the workspace from the page; downloading it instead.")
+        download_activity(driver, board_index)
+        session.invalidate()
+        download_name = get_top_download(driver).shadow_root.find_element(By.ID, "name").get_attribute("title")
+        with open(append_cur_dir("Downloads", download_name), 'r') as download:
+            xml_text = download.read()
+    index_workspace(link, info[0], xml_text)
 
     parsed_expressions : str = " - Parsed Expressions: \n"
     # begin parsing the activity with a log file open to write info to
     with open(append_cur_dir("Logging", "xml_log.txt"), 'a') as log:
         log.write("Opening: " + file_name + " - " + title + "; " + info[0] + "\n")
         print("\nOpening: " + file_name + " - " + title + "; " + info[0] + "\n")
-        curr_link_xml = etree.parse(file_location, etree.XMLParser(remove_blank_text=True))
-
-        # because of the complications with namespaces with lxml and the fact that only one is ever used,
-        # I am just using the * and local name to avoid the headache and poor documentation
-        # apparently elements come out as [<Element {http://www.w3.org/1999/xhtml}block at 0x7fd7f814e440>]
-        # apparently using .// isn't allowed
-        key = "//*[local-name()='block' and contains(@type, '" + target_expression + "')]//*[local-name()='value' and @name='" + target_name + "']"
-        expressions = curr_link_xml.xpath(key)
-        did_update = False
-        for expression in expressions:
-            container = expression[0]
-            # pure text has simpler handling
-            if container.attrib["type"] == "text":
-                print("Inspecting " + container[0].text + "\n")
-                parsed_expressions += "    " + container[0].text
-                updated_text = update_pow_expressions(container[0].text)
-                if updated_text != container[0].text:
-                    did_update = True
-                    container[0].text = updated_text
-                    print("Updated to " + updated_text + "\n")
-                    parsed_expressions += " -> " + updated_text
-                parsed_expressions += "\n"
-                continue
-
-            # if the expression isn't pure text or a text combination we can't modify it
-            if container.attrib["type"] != "text_join":
-                log.write("\t Found non-text/text-join element matching expression!\n")
-                continue
-
-            container_result = update_expression_container(container)
-            expr_updated = container_result[0]
-            parsed_expressions += container_result[1] + "\n"
-            if not did_update: did_update = expr_updated
+        curr_link_xml = etree.ElementTree(etree.fromstring(xml_text.encode(), etree.XMLParser(remove_blank_text=True)))
+
+        did_update, expressions_log, _ = rewrite_activity_xml(curr_link_xml, target_expression, log)
+        parsed_expressions += expressions_log
 
         log.write(parsed_expressions)
         if not did_update:
             log.write("------- No update needed ------- \n\n")
             print("No update needed for preceding activity. \n")
-            return  # nothing needed to be changed so we can skip
+            return outcome_no_op  # nothing needed to be changed so we can skip
         curr_link_xml.write(append_cur_dir("Results", file_name), pretty_print=True)
+        index_workspace(link, info[0], etree.tostring(curr_link_xml).decode())
         log.write("Finished: " + file_name + " - " + title + "; " + info[0] + "\n\n")
         print("Finished: " + file_name + " - " + title + "; " + info[0] + "\n")
 
-    path_components = append_cur_dir("Results", file_name)
-    path_components = path_components[path_components.find("PycharmProjects") : len(path_components)].split(os.sep)
-
-    # go back to activity and load the new xml file
-    open_and_ignore_prompt(driver, link)
-    select_target_type(driver, is_example, target_num)
-    if has_board: open_board(driver, link_info.is_pre())
+    # go back to activity if the download navigated away from it, then load the new xml file
+    if needs_reload:
+        session.open(link)
+        session.select_target(is_example, target_num)
+        if has_board: session.open_board(link_info.is_pre())
 
     # results in either loadBlocks or loadPreBoard or loadPostBoard
     load_id = "load"
@@ -234,60 +259,32 @@ def replace_pow_xml(driver : WebDriver, link , info : list[str]):
     else: load_id += "Blocks"
     goto_and_click(driver, load_id, By.ID)
 
-    # results in either loadBlocksMachine or loadBoardMachine
+    # results in either loadBlocksMachine or loadBoardMachine, the file input behind the load button
     load_id = "load"
     if has_board: load_id += "Board"
     else: load_id += "Blocks"
     load_id += "Machine"
-    load_button = wait_for_vis(driver, load_id, By.NAME)
-
-    # ensure browser is in focus, even though it should always be "on top". Assumes browser farthest right and
-    # assumes the browser is reasonably wide
-    browser_top_x : int = pyautogui.size()[0] * 3 / 4  # guessing the top is roughly 3/4 of the screen
-    browser_top_y : int = 15  # around 15 pixels from the top of the screen
-    prev_x : int = pyautogui.position()[0]
-    prev_y : int = pyautogui.position()[1]
-
-    # focus browser and hold
-    pyautogui.mouseDown(browser_top_x, browser_top_y, button='left')
-    pyautogui.sleep(0.2)
-    pyautogui.mouseUp(button='left')
-    sleep(0.2)  # let the browser realize we don't want to drag it
-
-    pyautogui.moveTo(prev_x, prev_y)  # return to previous position
-    load_button.click()  # must be in focus to open
-
-    # must be in focus to work
-    for file in path_components:
-        sleep(0.5)  # ensure after enter is hit the explorer has time to respond, or when it first opens
-        pyautogui.hotkey('ctrl', 'f')
-        pyautogui.write(file, 0.005)
-        sleep(0.2)  # enforce a manual delay to stop ctrl f and enter being pressed too close together
-        pyautogui.press('enter')
-
-    sleep(0.25)  # let the browser respond to the upload
+    upload_to_file_input(driver, load_id, append_cur_dir("Results", file_name))  # no file dialog needed
+
+    # only save once the workspace has actually taken in the new blocks
+    is_watched = watch_workspace_changes(driver, get_board_id_by_index(board_index))
     goto_and_click(driver, "//button[text()='Replace existing blocks']")
+    if is_watched: wait_for_workspace_change(driver)
 
     # we do not need to save changes to activity if we just changed board- only save part you changed
-    save_activity(driver, is_lesson, board_index)
-    sleep(0.5)  # give saving some time just in case
-
-    # re-enable min view
-    if was_min_view:
-        driver.get(link)  # re-open after saving
+    save_activity(driver, is_lesson, board_index)  # returns once the save has succeeded
 
-        # check that min view is not already enabled
-        if wait_and_get(driver, "guiButton", By.ID).get_attribute("disabled") is None:
-            goto_and_click(driver, "minView", By.ID)  # click min_view
-            save_activity(driver, is_lesson, 1)  # save the activity
+    # re-enable min view once the other entries of this activity are done too, as it was saved while turned off
+    if session.min_view_was_on: session.defer_min_view(is_lesson)
 
     print("Finished saving current link.")
 
 
 # will try to replace x^y in drive expressions with pow(x, y) [never in pre or post board]
 def replace_pow_interactive(driver : WebDriver, link, info : list[str]):
-    # open the link
-    open_and_ignore_prompt(driver, link)
+    # open the link, unless an earlier entry of this activity already did
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
 
     target_expression : str = info[len(info) - 1]
 
@@ -297,56 +294,197 @@ def replace_pow_interactive(driver : WebDriver, link, info : list[str]):
     target_num = link_info.get_num_str()
     has_board = link_info.is_pre() or link_info.is_post()  # neither board should be on for start blocks
 
-    select_target_type(driver, is_example, target_num)
-    svg_lineage = "//"
+    session.select_target(is_example, target_num)
+    board_id = None
     if has_board:
-        open_board(driver, link_info.is_pre())
-        svg_lineage = board_descendant_prefix(get_board_id(link_info.is_pre()))
-
-    # apparently svg elements must be captured directly, not as children of other elements ?
-    svgs = wait_and_gets(driver, svg_lineage + "*[name()='svg' and @class='blocklySvg']", By.XPATH)
-    workspace_svg = None
-    for svg in svgs:
-        if svg.find_element(By.XPATH, "./..").get_attribute("id") == "content_blocks":
-            workspace_svg = svg
-            break
-
-    # for some reason, this xpath formulation of contains is necessary. Not sure why
-    targeted_texts = workspace_svg.find_elements(By.XPATH, "./descendant::*[text()[contains(., '" + target_expression + "')]]")
-    for curr_text in targeted_texts:
-        #print_element(driver, curr_carrier)
+        session.open_board(link_info.is_pre())
+        board_id = get_board_id(link_info.is_pre())
 
-        # we use contains so that even selected elements are considered
-        parent = curr_text.find_element(By.XPATH, "./..")
-        sub_blocks = parent.find_elements(By.XPATH, "./child::*[name()='g' and @class='blocklyDraggable']")
-        # expression_block = sub_blocks[len(sub_blocks) - 2]  # last draggable is next draggable, second to last is expr
-        sub_blocks.sort(key=lambda sub_block: get_x_trans(sub_block))  # our target should be furthest right (>> x trans)
-        expression_block = sub_blocks[len(sub_blocks) - 1]
-        text_boxes = expression_block.find_elements(By.XPATH, "./child::*[name()='g' and @class='blocklyEditableText']")
+    # read every targeted field from the workspace, then write back just the changed ones in one go
+    fields = get_expression_fields(driver, board_id, target_expression)
+    if fields is None: raise ValueError("Could not find the blockly workspace of the activity.")
 
-        for text_box in text_boxes:
-            text_element = text_box.find_element(By.XPATH, "./child::*[name()='text' and @class='blocklyText']")
+    updates : list[tuple[str, str, str]] = []
+    for block_id, field_name, text in fields:
+        updated_text = update_pow_expressions(text)
+        if updated_text != text: updates.append((block_id, field_name, updated_text))
 
-            workspace : BlocklyWorkspace = BlocklyWorkspace(driver)
-            workspace.scroll_to(driver, text_element)
+    if len(updates) == 0:
+        print("No update needed for: " + link)
+        return outcome_no_op
 
-            # update the expression
-            updated_text = update_pow_expressions(text_element.text)
-            if updated_text == text_element.text: continue
-            ActionChains(driver).move_to_element(text_element).click().perform()  # go to element and select it
-            ActionChains(driver).send_keys(Keys.BACKSPACE).perform()  # acts as if a keystroke was pressed
-            ActionChains(driver).send_keys_to_element(text_box, updated_text).perform()  # directly sends keys
-
-            # de-select the block
-            ActionChains(driver).move_to_element(parent).move_by_offset(1 + parent.size["width"] / 2, 0).click().perform()
+    print("Updating " + str(len(updates)) + "/" + str(len(fields)) + " expressions")
+    updated = set_field_values(driver, board_id, updates)
+    if updated != len(updates):
+        # some blocks went missing since they were read, so leave the page (and its partial edit) unsaved
+        session.invalidate()
+        raise ValueError("Only " + str(updated) + " of " + str(len(updates)) + " expressions could be updated.")
 
     # we need to close the board before we save this link
     if has_board: close_board(driver, link_info.is_pre())
 
     save_activity(driver, is_lesson)
+    if session.min_view_was_on: session.defer_min_view(is_lesson)
 
     print("Finished replacing drive power expressions for: " + link)
 
+# the planners look at what their action would change without changing anything, returning the changes or None
+
+def plan_update_models(driver, link, info : list[str]) -> dict | None:
+    model = info[len(info) - 1]  # last info is always model
+    link_info : LinkInfo = LinkInfo(info[0])
+
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
+
+    changes : dict = {}
+    if fixup_cache is not None and fixup_cache.get(link) is not None: session.fixup_done = True
+    if not session.fixup_done:
+        session.select_target(False, None)  # the fixup starts from the start blocks
+        _, fixup_assignments = inspect_fixup(driver, link)
+        session.fixup_done = True
+        session.target = "fixup source"  # inspecting opened an example or solution
+        if len(fixup_assignments) > 0: changes["fixup"] = {str(i): fixup_assignments[i] for i in fixup_assignments}
+
+    session.select_target(link_info.is_example(), link_info.get_num_str())
+    if get_robots(driver) is not None:
+        robots = get_robot_inventory(driver)
+        assignments = {str(robot.index): model for robot in robots if robot.model == "Linkbot"}
+        if len(assignments) > 0: changes["robots"] = assignments
+
+    if len(changes) == 0: return None
+    return changes
+
+def plan_replace_pow_xml(driver, link, info : list[str]) -> dict | None:
+    target_expression : str = info[len(info) - 1]
+    link_info : LinkInfo = LinkInfo(info[0])
+
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
+    session.select_target(link_info.is_example(), link_info.get_num_str())
+
+    board_index : int = 1
+    if link_info.is_pre() or link_info.is_post():
+        board_index = 2 if link_info.is_pre() else 3
+        session.open_board(link_info.is_pre())
+
+    xml_text = export_workspace_xml(driver, board_index)
+    if xml_text is None: return {"unreadable": True}  # leave it to the apply run, which can download it instead
+    index_workspace(link, info[0], xml_text)
+
+    activity_xml = etree.ElementTree(etree.fromstring(xml_text.encode(), etree.XMLParser(remove_blank_text=True)))
+    did_update, _, changes = rewrite_activity_xml(activity_xml, target_expression)
+    if not did_update: return None
+    return {"expressions": changes}
+
+def plan_replace_pow_interactive(driver, link, info : list[str]) -> dict | None:
+    target_expression : str = info[len(info) - 1]
+    link_info : LinkInfo = LinkInfo(info[0])
+
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
+    session.select_target(link_info.is_example(), link_info.get_num_str())
+
+    board_id = None
+    if link_info.is_pre() or link_info.is_post():
+        session.open_board(link_info.is_pre())
+        board_id = get_board_id(link_info.is_pre())
+
+    fields = get_expression_fields(driver, board_id, target_expression)
+    if fields is None: return {"unreadable": True}
+
+    changes = [text + " -> " + update_pow_expressions(text) for _, _, text in fields
+               if update_pow_expressions(text) != text]
+    if len(changes) == 0: return None
+    return {"expressions": changes}
+
+def get_planner(action):
+    if action == replace_pow_interactive:
+        return plan_replace_pow_interactive
+    elif action == replace_pow_xml:
+        return plan_replace_pow_xml
+
+    return plan_update_models
+
+# runs the planner in place of its action, adding every link it finds changes for to the plan
+def get_plan_action(planner, action_name : str, target_info, plan : ChangePlan):
+    def plan_action(driver, link, info : list[str]):
+        changes = planner(driver, link, info)
+        if changes is None: return outcome_no_op
+        plan.add(action_name, target_info, link, info[0], changes)
+        return outcome_success
+
+    plan_action.__name__ = planner.__name__  # journals the plan run apart from the action itself
+    return plan_action
+
+# runs the action, taking each link off the plan once it has gone through
+def get_apply_action(action, target_info, plan : ChangePlan):
+    def apply_action(driver, link, info : list[str]):
+        outcome = action(driver, link, info)
+        plan.resolve(action.__name__, target_info, link, info[0])
+        return outcome
+
+    apply_action.__name__ = action.__name__
+    return apply_action
+
+# the fingerprinters read just what their action looks at on a link, so a link which has not changed since the action
+# last found nothing to do on it can be skipped before any of the action's work. None means it could not be read
+
+def fingerprint_robots(driver, link, info : list[str]) -> str | None:
+    link_info : LinkInfo = LinkInfo(info[0])
+
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
+
+    # update_models also tries the fixup of the activity, which the models of this link say nothing about, so the link
+    # can not be skipped while the fixup is still to be tried (or rechecked)
+    if not session.fixup_done and (fixup_cache is None or fixup_cache.get(link) is None): return None
+    session.select_target(link_info.is_example(), link_info.get_num_str())
+
+    if get_robots(driver) is None: return get_fingerprint("no robots")
+    return get_fingerprint("\n".join(get_robot_models(driver)))
+
+def fingerprint_workspace(driver, link, info : list[str]) -> str | None:
+    link_info : LinkInfo = LinkInfo(info[0])
+
+    session : ActivitySession = get_activity_session(driver)
+    session.open(link)
+    session.select_target(link_info.is_example(), link_info.get_num_str())
+
+    board_index : int = 1
+    if link_info.is_pre() or link_info.is_post():
+        board_index = 2 if link_info.is_pre() else 3
+        session.open_board(link_info.is_pre())
+
+    xml_text = export_workspace_xml(driver, board_index)
+    if xml_text is None: return None
+    index_workspace(link, info[0], xml_text)
+    return get_fingerprint(str(rewriter_version) + "\n" + xml_text)  # a new rewriter may find things to change
+
+def get_fingerprinter(action):
+    if action == replace_pow_interactive or action == replace_pow_xml:
+        return fingerprint_workspace
+
+    return fingerprint_robots
+
+# runs the action only if the link changed since the action last found nothing to change on it
+def get_fingerprinted_action(action, fingerprinter, target_info, store : FingerprintStore):
+    def fingerprinted_action(driver, link, info : list[str]):
+        fingerprint = fingerprinter(driver, link, info)
+        if fingerprint is not None and store.is_verified(action.__name__, target_info, link, info[0], fingerprint):
+            print("Unchanged since it last needed nothing; skipping: " + link)
+            return outcome_no_op
+
+        outcome = action(driver, link, info)
+        if outcome == outcome_no_op and fingerprint is not None:
+            store.verify(action.__name__, target_info, link, info[0], fingerprint)
+        else:
+            store.forget(action.__name__, target_info, link, info[0])
+        return outcome
+
+    fingerprinted_action.__name__ = action.__name__
+    return fingerprinted_action
+
 def get_action(action_name : str):
     if action_name.upper() == "REPLACE_POW":
         return replace_pow_interactive
@@ -355,86 +493,258 @@ def get_action(action_name : str):
 
     return update_models
 
-def parse_by_links(action, target_info, separator):
-    driver = init_bare_driver()  # allows images to load properly so they can be selected
-    links = []
-    info : list[list[str]] = []
+# loads the list of links (and their info) from the link page, keeping the link store up to date with it
+def load_links(driver, source_link : str, store : LinkStore, filters : dict):
+    # carry over the list from the old text cache the first time the store sees this page
+    last_split_index: int = source_link.rfind('/')
+    link_file_dir = append_cur_dir("Logging", source_link[last_split_index + 1: len(source_link) - 4] + ".txt")
+    if not store.has_source(source_link) and os.path.exists(link_file_dir):
+        store.refresh(source_link, read_link_text_cache(link_file_dir))
+
+    print("Gathering links...")
+    entries = scrape_links(driver)
+    if len(entries) == 0:
+        print("No links found on the link page; using the stored list.")
+    elif store.refresh(source_link, entries):
+        print("The link page changed since it was last stored; the stored list has been updated.")
+
+    return store.query(source_link, **filters)
+
+# the link store query filters for the --filter and --num arguments
+def get_link_filters(filter_names : list[str] | None, num : int | None) -> dict:
+    filters : dict = {"num": num}
+    for filter_name in filter_names or []:
+        if filter_name == "lesson": filters["is_lesson"] = True
+        elif filter_name == "activity": filters["is_lesson"] = False
+        elif filter_name == "pre": filters["board"] = "pre"
+        elif filter_name == "post": filters["board"] = "post"
+        elif filter_name == "no-board": filters["board"] = "none"
+        elif filter_name == "example": filters["is_example"] = True
+        elif filter_name == "solution":
+            filters["is_example"] = False
+            filters["numbered"] = True  # start blocks are not examples either
+        elif filter_name == "start": filters["num"] = 0
+
+    return filters
+
+# runs the action over every link in order, retrying a failed link as the retry policy allows before giving up on it
+def process_links(driver, action, links, info : list[list[str]], target_info, progress : RunProgress,
+                  journal : ProgressJournal, retry_policy : RetryPolicy, dead_letters : DeadLetterQueue,
+                  worker_name : str = "", prefetch_depth : int = 0):
+    prefetcher : TabPrefetcher | None = None
+    if prefetch_depth > 0:
+        prefetcher = TabPrefetcher(driver, prefetch_depth)
+        tab_prefetchers[driver] = prefetcher
+    session : ActivitySession = get_activity_session(driver)
+
+    for i in range(0, len(links)):
+        link = links[i]
+        curr_info = info[i]
+        curr_info.append(target_info)  # last piece of information is always model
+        progress.start_link(worker_name, link, curr_info)
+        if prefetcher is not None: prefetcher.prefetch(get_prefetch_links(links, i, prefetch_depth))
+        link_start = time()
+        outcome = None
+        attempt = 0
+        while outcome is None:
+            attempt += 1
+            attempt_start = time()
+            try:
+                outcome = action(driver, link, curr_info)
+                if outcome is None: outcome = outcome_success
+                journal.record(action.__name__, target_info, link, curr_info[0], outcome, time() - attempt_start)
+                dead_letters.resolve(action.__name__, target_info, link, curr_info[0])
+            except Exception as error:
+                session.invalidate()  # the page is in an unknown state, so the next attempt starts from a fresh load
+                error_class = classify_error(error)
+                journal.record(action.__name__, target_info, link, curr_info[0], outcome_failure,
+                               time() - attempt_start, error_class + ": " + repr(error))
+                print(worker_name + "Got " + error_class + " error on link: " + link + "<" + str(i + 1) + "/" +
+                      str(len(links)) + ">  of: \n", error, "\n and traceback: \n", traceback.format_exc())
+
+                if not retry_policy.should_retry(error_class, attempt):
+                    print(worker_name + "Giving up on this link after " + str(attempt) + " attempts; adding it to the dead letters")
+                    dead_letters.add(action.__name__, target_info, link, curr_info[0], error_class, repr(error), attempt)
+                    outcome = outcome_failure
+                    break
+
+                delay = retry_policy.get_delay(error_class, attempt)
+                print(worker_name + "Trying to run on this link again in " + "{:.2f}".format(delay) + "s")
+                sleep(delay)
+            # last line of link processing
+        progress.finish_link(worker_name, link, curr_info, outcome, time() - link_start)
+
+        # wrap up the activity once its last entry is done
+        if i + 1 == len(links) or get_activity_url(links[i + 1]) != get_activity_url(link):
+            try:
+                session.finish()
+            except Exception as error:
+                print(worker_name + "Could not turn min view back on for: " + link + "\n", error)
+
+    session.report()
+    activity_sessions.pop(driver)
+
+    if prefetcher is not None:
+        prefetcher.close_unused()
+        prefetcher.report()
+        tab_prefetchers.pop(driver)
+
+# the next depth links after index, in visit order, which will load a page. The links are grouped by activity (see
+# group_links_by_activity) and the rest of a group reuses the page of its first link, so only the first link of each
+# later group is loaded, however many links the current group still has. No earlier link is on its activity, so its
+# tab can not go stale from an earlier save
+def get_prefetch_links(links : list[str], index : int, depth : int) -> list[str]:
+    prefetch_links : list[str] = []
+    for i in range(index + 1, len(links)):
+        if len(prefetch_links) >= depth: break
+        if get_activity_url(links[i]) != get_activity_url(links[i - 1]): prefetch_links.append(links[i])
+
+    return prefetch_links
+
+def parse_by_links(action, target_info, separator, workers : int = 1, prefetch_depth : int = 0, resume : bool = False,
+                   retry_policy : RetryPolicy = RetryPolicy(), only_dead_letters : bool = False,
+                   link_filters : dict | None = None, page_load_strategy : str = "normal", fast : bool = False,
+                   phase : str = "all", recheck_fixups : bool = False, skip_unchanged : bool = True,
+                   indexed : bool = False, start_from_link : str | None = None):
+    global fixup_cache, corpus_index
+    fixup_cache = FixupCache(recheck=recheck_fixups)
+    corpus_index = CorpusIndex()
+    rewrite_cache.open(append_cur_dir("Logging", "rewrite_cache.json"))
+
+    # allows images to load properly so they can be selected
+    driver = init_bare_driver(page_load_strategy=page_load_strategy, fast=fast)
 
     # get links from provided link page
     source_link : str = "https://www.roboblocky.com/activity-portal/script_drawExprPower.php"
-    start_from_link = "https://www.roboblocky.com/u/12008.php"
     driver.get(source_link)  # useful even if we don't parse from it because we want to make sure user is logged in
 
-    # store the link list
-    last_split_index: int = source_link.rfind('/')
-    link_file_dir = append_cur_dir("Logging", source_link[last_split_index + 1: len(source_link) - 4] + ".txt")
-    if os.path.exists(link_file_dir):
-        # read from link file
-        with open(link_file_dir, 'r') as link_file:
-            lines = link_file.readlines()
-            line_count : int = 0
-            while line_count < len(lines):
-                link_line = lines[line_count]
-                info_line = lines[line_count + 1]
-                links.append(link_line[link_line.find("]:") + 3 : len(link_line) - 1])  # ensure to drop \n
-                info.append([info_line[info_line.find('[') + 1 : info_line.rfind(']')].strip('\'')])  # drop '
-
-                # skip the whitespace line
-                line_count += 3
-    else:
-        # parse from list of links
-        print("Gathering links...")
-        link_elements = wait_and_gets(driver, "//div[@class='row']//a[@target=\'_blank\']", by_val=By.XPATH)
-        for element in link_elements:
-            links.append(element.get_attribute("href"))
-            info.append([element.text.strip('\'')])  # we will parse this later
-
-        # write to file
-        with open(link_file_dir, 'a') as link_file:
-            for i in range(0, len(links)):
-                link_file.write("[" + str(i) + "]: " + links[i] + "\n    INFO: " + str(info[i]) + "\n\n")
+    links, info = load_links(driver, source_link, LinkStore(), link_filters or {})
 
     print("Finished gathering links, pruning now.")
 
-    # used to avoid re-doing previously computed work
+    # skips the links before the given one, though --resume is usually what is wanted
     if start_from_link is not None:
         for i in range(0, len(links)):
             if links[i] == start_from_link:
                 links = links[i : len(links)]
                 info = info[i : len(info)]
                 break
+        else:
+            print("The link to start from is not in the link list; starting from the first link.")
 
     # the list automatically shrinks when its been detected as completed?
     print("Finished pruning, beginning looping.")
-    ensure_logged_in(driver)
 
     #links = ["https://roboblocky.com/u/5932.php"]
     action = get_action(action)
+    journal : ProgressJournal = ProgressJournal()
+    dead_letters : DeadLetterQueue = DeadLetterQueue()
+
+    # re-run just the links which ran out of attempts before
+    if only_dead_letters:
+        dead_links = dead_letters.get_links(action.__name__, target_info)
+        links = [link for link, _ in dead_links]
+        info = [[descriptor] for _, descriptor in dead_links]
+        print("Re-running " + str(len(links)) + " dead-lettered links.")
+
+    # leave out the sub-targets the corpus index knows have nothing to rewrite; ones it has never seen are kept. The
+    # interactive rewrite picks its fields by their label rather than by the values the index records, so only the xml
+    # rewrite can go by it
+    if indexed:
+        if action == replace_pow_xml:
+            known = corpus_index.get_files()
+            candidates = find_pow_candidates(corpus_index, target_info)
+            remaining = [i for i in range(0, len(links)) if get_export_file_name(links[i], info[i][0]) not in known
+                         or get_export_file_name(links[i], info[i][0]) in candidates]
+            print("The corpus index rules out " + str(len(links) - len(remaining)) + " of " + str(len(links)) + " links.")
+            links = [links[i] for i in remaining]
+            info = [info[i] for i in remaining]
+        else:
+            print("The corpus index only narrows down the xml pow rewrite; running on every link.")
+
+    # check each link against what it looked like when the action last had nothing to do on it
+    if skip_unchanged and phase != "plan":
+        action = get_fingerprinted_action(action, get_fingerprinter(action), target_info, FingerprintStore())
+
+    # the plan phase only looks at every link, noting the ones which need changes; the apply phase then visits just those
+    plan : ChangePlan = ChangePlan()
+    if phase == "plan":
+        if not resume: plan.clear(action.__name__, target_info)  # a resumed plan run adds to the plan it left
+        action = get_plan_action(get_planner(action), action.__name__, target_info, plan)
+    elif phase == "apply":
+        planned = set(plan.get_links(action.__name__, target_info))
+        remaining = [i for i in range(0, len(links)) if (links[i], info[i][0]) in planned]
+        print("Applying the plan to " + str(len(remaining)) + " of " + str(len(links)) + " links.")
+        links = [links[i] for i in remaining]
+        info = [info[i] for i in remaining]
+        action = get_apply_action(action, target_info, plan)
+
+    # skip everything the journal shows was already done by this action with this info
+    if resume:
+        completed = journal.get_completed(action.__name__, target_info)
+        remaining = [i for i in range(0, len(links)) if (links[i], info[i][0]) not in completed]
+        print("Resuming: skipping " + str(len(links) - len(remaining)) + " links completed in earlier runs.")
+        links = [links[i] for i in remaining]
+        info = [info[i] for i in remaining]
+
+    # every entry of an activity is handled during one visit to its page
+    links, info = group_links_by_activity(links, info)
+
     #print("All links collected, printing first 20: \n", links[0:20])
-    link_index = 0
-    for i in range(0, len(links)):
-        link = links[i]
-        curr_info = info[i]
-        curr_info.append(target_info)  # last piece of information is always model
-        link_index += 1
-        print("On link " + str(link_index) + "/" + str(len(links)) + " with info: " + str(curr_info))
-        succeeded = False
-        while not succeeded:
-            try:
-                action(driver, link, curr_info)
-                succeeded = True
-            except Exception as error:
-                print("Got error on link: " + link + "<" + str(link_index) + "/" + str(len(links)) + ">  of: \n", error,
-                      "\n and traceback: \n", traceback.format_exc())
-                print("Trying to run on this link again")
-                #update_models(driver, link, info)  # try again
-                #print("Navigate to a new webpage to continue process")
-                #while driver.current_url == link:
-                    #driver.implicitly_wait(5)
-            # last line of link processing
+    last_split_index : int = source_link.rfind('/')
+    result_log = append_cur_dir("Logging", source_link[last_split_index + 1 : len(source_link) - 4] + "_results.txt")
+    progress : RunProgress = RunProgress(len(links), result_log)
+
+    if workers <= 1:
+        ensure_logged_in(driver, not fast)
+        process_links(driver, action, links, info, target_info, progress, journal, retry_policy, dead_letters,
+                      prefetch_depth=prefetch_depth)
+        print("Finished processing all links")
+        progress.report()
+        report_wait_latencies()
+        rewrite_cache.save()
+        rewrite_cache.report()
+        driver.quit()
+        return
 
+    # every worker gets its own browser profile; Roboblocky ends simultaneous sessions on one account, so each
+    # worker window must be logged in to a different account (the profile remembers it for later runs)
+    def run_worker(worker_index : int, shard):
+        worker_name = "[worker " + str(worker_index) + "] "
+        worker_driver = driver
+        if worker_index > 0:
+            worker_driver = init_bare_driver("testing" + str(worker_index), page_load_strategy, fast)
+            worker_driver.get(source_link)
+
+        print(worker_name + "Log in with this worker's own account if it is not already logged in.")
+        ensure_logged_in(worker_driver, not fast)
+        try:
+            process_links(worker_driver, action, shard[0], shard[1], target_info, progress, journal, retry_policy,
+                          dead_letters, worker_name, prefetch_depth)
+        finally:
+            worker_driver.quit()
+
+    # a worker which stops (e.g. its browser would not start) dead-letters what it left, so a later run can pick it up
+    # with --dead-letters instead of it silently going missing
+    def drop_shard(worker_index : int, shard, error : Exception):
+        error_class = classify_error(error)
+        dropped = 0
+        for link, curr_info in zip(shard[0], shard[1]):
+            if progress.is_finished(link, curr_info[0]): continue
+            journal.record(action.__name__, target_info, link, curr_info[0], outcome_failure, 0,
+                           error_class + ": " + repr(error))
+            dead_letters.add(action.__name__, target_info, link, curr_info[0], error_class, repr(error), 0)
+            dropped += 1
+        progress.drop_links("[worker " + str(worker_index) + "] ", dropped)
+
+    shards = shard_links(links, info, workers)
+    print("Split " + str(len(links)) + " links between " + str(len(shards)) + " workers.")
+    run_worker_pool(shards, run_worker, drop_shard)
     print("Finished processing all links")
-    driver.quit()
+    progress.report()
+    report_wait_latencies()
+    rewrite_cache.save()
+    rewrite_cache.report()
 
 def go_to_curriculum(driver, grade_index):
     row = wait_and_gets(driver, "tr", By.TAG_NAME)[int(grade_index / 4)]
@@ -483,6 +793,77 @@ def parse_args():
     parser.add_argument("--info",
                         help="The information to use for the given action (model name, etc).",
                         required=False)
+    parser.add_argument("--workers",
+                        help="The number of browsers to split the links between, each logged in to its own account.",
+                        type=int,
+                        default=1,
+                        required=False)
+    parser.add_argument("--prefetch",
+                        help="The number of upcoming activity pages to keep loading in background tabs of each browser.",
+                        type=int,
+                        default=0,
+                        required=False)
+    parser.add_argument("--page-load",
+                        help="When opening a page returns: once everything has loaded (normal), once the document is "
+                             "parsed (eager) or right away (none). Activities are always worked on once their "
+                             "workspace, robots and save tabs are there.",
+                        choices=["normal", "eager", "none"],
+                        default="normal",
+                        required=False)
+    parser.add_argument("--fast",
+                        help="Run the browsers headless and skip loading analytics, fonts, videos and images other "
+                             "than the robot models. Each browser profile must already be logged in from a normal run.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--phase",
+                        help="Run the action on every link (all), only note which links need changes without changing "
+                             "anything (plan), or run the action on just the links noted by the last plan (apply).",
+                        choices=["all", "plan", "apply"],
+                        default="all",
+                        required=False)
+    parser.add_argument("--recheck-fixups",
+                        help="Try the robot model fixup on every activity again, even those an earlier run already "
+                             "tried it on.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--recheck-unchanged",
+                        help="Run the action even on links which have not changed since it last found nothing to do "
+                             "on them.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--indexed",
+                        help="Skip the links whose workspace the corpus index (Logging/corpus.db) shows has nothing "
+                             "for the pow rewrite to change.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--resume",
+                        help="Skip links which the journal shows were completed with the same action and info.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--start-from",
+                        help="Skip every link before this one in the link list.",
+                        type=str,
+                        required=False)
+    parser.add_argument("--max-attempts",
+                        help="How many times a link is tried before it is added to the dead letters.",
+                        type=int,
+                        default=4,
+                        required=False)
+    parser.add_argument("--dead-letters",
+                        help="Only re-run the links which previously ran out of attempts with this action and info.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--filter",
+                        help="Only process links of these kinds: lesson, activity, pre, post, no-board, example, "
+                             "solution or start (start blocks). Start can not be combined with --num.",
+                        choices=["lesson", "activity", "pre", "post", "no-board", "example", "solution", "start"],
+                        nargs="+",
+                        required=False)
+    parser.add_argument("--num",
+                        help="Only process the example or solution with this number. Can not be combined with "
+                             "--filter start, as start blocks have no number.",
+                        type=int,
+                        required=False)
     parser.add_argument("--grades",
                         help="The grade levels to be targeted by the automatic robot searcher.",
                         required=False)
@@ -491,7 +872,10 @@ def parse_args():
                         help="The specific chapters which are to be targeted. None supplied implies all.",
                         required=False)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.filter is not None and "start" in args.filter and args.num is not None:
+        parser.error("--filter start selects the start blocks, which have no number, so it can not be used with --num")
+    return args
 
 def do_test() -> bool:
     return False
@@ -519,7 +903,11 @@ def activity_updater():
 
     # ---------------------- START PROCESSING -------------------------- #
 
-    if grades is None: parse_by_links(action, info, separator)
+    if grades is None: parse_by_links(action, info, separator, args.workers, args.prefetch, args.resume,
+                                      RetryPolicy(args.max_attempts), args.dead_letters,
+                                      get_link_filters(args.filter, args.num), args.page_load, args.fast,
+                                      args.phase, args.recheck_fixups, not args.recheck_unchanged, args.indexed,
+                                      args.start_from)
     elif grades is not None:
         parse_by_grades(action, info, grades, chapters)
 
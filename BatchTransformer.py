@@ -0,0 +1,120 @@
+import contextlib
+import io
+import json
+import tarfile
+import traceback
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from time import time
+
+from Utils import *
+
+# gathers (relative name, path or contents) for every xml file in the directory or tarball
+def collect_activity_files(source : str) -> list[tuple[str, str | bytes]]:
+    files : list[tuple[str, str | bytes]] = []
+    if os.path.isdir(source):
+        for directory, _, file_names in os.walk(source):
+            for file_name in file_names:
+                if not file_name.endswith(".xml"): continue
+                path = os.path.join(directory, file_name)
+                files.append((os.path.relpath(path, source), path))
+    else:
+        # members are read here so the workers don't each need to re-open the archive
+        with tarfile.open(source) as archive:
+            for member in archive.getmembers():
+                if not member.isfile() or not member.name.endswith(".xml"): continue
+                files.append((member.name, archive.extractfile(member).read()))
+
+    files.sort(key=lambda file: file[0])
+    return files
+
+# where the file with this relative name goes in the output directory. Names come from archive members, which can
+# point anywhere (../x.xml, /x.xml or through a symlink), so anything resolving outside the directory is refused
+def get_out_location(out_dir : str, name : str) -> str:
+    out_root = os.path.realpath(out_dir)
+    out_location = os.path.realpath(os.path.join(out_root, name))
+    if os.path.commonpath([out_root, out_location]) != out_root or out_location == out_root:
+        raise ValueError("refusing to write " + name + " outside of " + out_dir)
+    return out_location
+
+# rewrites one activity file, writing it to the output directory only if something changed
+# returns the file's entry for the change manifest
+def transform_activity_file(job : tuple[str, str | bytes, str, str]) -> dict:
+    name, contents, target_expression, out_dir = job
+    entry : dict = {"file": name, "status": "unchanged", "changes": []}
+    try:
+        out_location = get_out_location(out_dir, name)
+        if isinstance(contents, str):
+            with open(contents, 'rb') as source:
+                contents = source.read()
+
+        # the rewriter narrates every expression, which is just noise across thousands of files
+        with contextlib.redirect_stdout(io.StringIO()):
+            activity_xml = etree.ElementTree(etree.fromstring(contents, etree.XMLParser(remove_blank_text=True)))
+            did_update, _, changes = rewrite_activity_xml(activity_xml, target_expression)
+
+        if not did_update: return entry
+
+        os.makedirs(os.path.dirname(out_location), exist_ok=True)
+        activity_xml.write(out_location, pretty_print=True)
+        entry["status"] = "updated"
+        entry["changes"] = changes
+    except Exception as error:
+        entry["status"] = "error"
+        entry["error"] = str(error) + "\n" + traceback.format_exc()
+
+    return entry
+
+def transform_activities(source : str, out_dir : str, target_expression : str, processes : int | None) -> list[dict]:
+    files = collect_activity_files(source)
+    jobs = [(name, contents, target_expression, out_dir) for name, contents in files]
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Pool(processes) as pool:
+        chunk_size = max(1, len(jobs) // ((processes or os.cpu_count() or 1) * 8))
+        entries = list(pool.imap(transform_activity_file, jobs, chunksize=chunk_size))
+
+    # every file is listed, so untouched files can be told apart from ones that were never looked at
+    with open(os.path.join(out_dir, "manifest.json"), 'w') as manifest:
+        json.dump({"source": source, "info": target_expression, "files": entries}, manifest, indent=2)
+
+    return entries
+
+def parse_args():
+    parser = ArgumentParser("BatchTransformer")
+    parser.add_argument("source",
+                        help="A directory or tarball of exported activity xml files.",
+                        type=str)
+    parser.add_argument("--out",
+                        help="The directory to write rewritten files and the manifest to.",
+                        type=str,
+                        default=append_cur_dir("Results", "batch"),
+                        required=False)
+    parser.add_argument("--info",
+                        help="The expression block type to target (draw_expr, or a drive block type).",
+                        type=str,
+                        default="draw_expr",
+                        required=False)
+    parser.add_argument("--processes",
+                        help="The number of worker processes. Defaults to one per CPU.",
+                        type=int,
+                        required=False)
+
+    return parser.parse_args()
+
+def batch_transformer():
+    args = parse_args()
+    start = time()
+    entries = transform_activities(args.source, args.out, args.info, args.processes)
+
+    updated = [entry for entry in entries if entry["status"] == "updated"]
+    errors = [entry for entry in entries if entry["status"] == "error"]
+    for entry in errors:
+        print("Failed on " + entry["file"] + ": " + entry["error"])
+
+    print("Processed " + str(len(entries)) + " files in " + "{:.2f}".format(time() - start) + "s: " +
+          str(len(updated)) + " updated, " + str(len(entries) - len(updated) - len(errors)) + " unchanged, " +
+          str(len(errors)) + " failed. Manifest written to " + os.path.join(args.out, "manifest.json"))
+
+if __name__ == '__main__':
+    batch_transformer()
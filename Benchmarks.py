@@ -0,0 +1,196 @@
+import contextlib
+import io
+import json
+import random
+import statistics
+import tracemalloc
+from argparse import ArgumentParser
+from time import perf_counter
+
+from Utils import *
+
+# ------------------------- synthetic inputs ------------------------- #
+
+# a drive-style expression with the given number of terms, about half of them powers
+def generate_long_expression(terms : int, seed : int = 0) -> str:
+    rng = random.Random(seed)
+    parts : list[str] = []
+    for i in range(0, terms):
+        coefficient = str(rng.randint(1, 9)) + "." + str(rng.randint(0, 99))
+        operand = rng.choice(["x", "t", "(x+" + str(i) + ")", "(2*t-1)"])
+        if rng.random() < 0.5: parts.append(coefficient + "*" + operand + "^" + str(rng.randint(2, 4)))
+        else: parts.append(coefficient + "*" + operand)
+    return " + ".join(parts)
+
+# a power of a power of ... of x, nested depth times: ((x^2)^2)^2
+def generate_nested_power(depth : int) -> str:
+    return "(" * depth + "x" + ")^2" * depth
+
+# an expression already written with pow, with redundant parenthesis around every argument list
+def generate_pow_calls(count : int) -> str:
+    return " + ".join("pow((x" + str(i) + "," + str(i % 5 + 2) + "))" for i in range(0, count))
+
+def make_text_block(text : str):
+    block = etree.Element("block", {"type": "text"})
+    etree.SubElement(block, "field", {"name": "TEXT"}).text = text
+    return block
+
+# a text_join container whose slots alternate between text holding powers and variables
+def generate_text_join(slots : int):
+    container = etree.Element("block", {"type": "text_join"})
+    etree.SubElement(container, "mutation", {"items": str(slots)})
+    for i in range(0, slots):
+        value = etree.SubElement(container, "value", {"name": "ADD" + str(i)})
+        if i % 2 == 0:
+            value.append(make_text_block("(" if i == 0 else ")^2 + ("))
+        else:
+            variable = etree.SubElement(value, "block", {"type": "variables_get"})
+            etree.SubElement(variable, "field", {"name": "VAR"}).text = "v" + str(i)
+    return container
+
+# an activity document with the given number of draw_expr blocks, mixing text and text_join expressions
+def generate_activity_document(blocks : int, seed : int = 0):
+    rng = random.Random(seed)
+    root = etree.Element("{http://www.w3.org/1999/xhtml}xml")
+    for i in range(0, blocks):
+        block = etree.SubElement(root, "block", {"type": "draw_expr", "id": "b" + str(i)})
+        value = etree.SubElement(block, "value", {"name": "VALUE_4"})
+        if rng.random() < 0.7: value.append(make_text_block(generate_long_expression(4, seed + i)))
+        else: value.append(generate_text_join(7))
+    return etree.ElementTree(root)
+
+# ------------------------- measurement ------------------------- #
+
+# times run(argument) for each prepared argument, returning the median seconds and the peak traced memory in kb
+def measure(run, arguments : list) -> dict:
+    timings : list[float] = []
+    with contextlib.redirect_stdout(io.StringIO()):  # some of these narrate everything they do
+        for argument in arguments[1 : len(arguments)]:
+            start = perf_counter()
+            run(argument)
+            timings.append(perf_counter() - start)
+
+        # memory is traced on a separate run since tracing slows everything down
+        tracemalloc.start()
+        run(arguments[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {"seconds": statistics.median(timings), "peak_kb": peak / 1024}
+
+# rewrites the expressions through a fresh cache, the way a run meets the same expressions over and over
+def rewrite_through_cache(expressions : list[str]) -> list[str]:
+    cache : RewriteCache = RewriteCache()
+    return [cache.get_rewrite(expression, rewrite_pow_expressions) for expression in expressions]
+
+# every benchmark as name -> (operation, function producing a fresh argument for each run)
+def get_benchmarks(scale : int) -> dict:
+    long_expression = generate_long_expression(200 * scale)
+    nested_power = generate_nested_power(50 * scale)
+    pow_calls = generate_pow_calls(100 * scale)
+    caret_index = long_expression.find('^')
+
+    return {
+        "update_pow_expressions/long": (update_pow_expressions, lambda: long_expression),
+        "update_pow_expressions/nested": (update_pow_expressions, lambda: nested_power),
+        "rewrite_cache/repeated": (rewrite_through_cache,
+                                   lambda: [generate_long_expression(20, seed % 10) for seed in range(0, 100 * scale)]),
+        "legacy_update_pow_expressions/long": (legacy_update_pow_expressions, lambda: long_expression),
+        "legacy_update_pow_expressions/nested": (legacy_update_pow_expressions, lambda: nested_power),
+        "inspect_pow_expressions/pow_calls": (inspect_pow_expressions, lambda: pow_calls),
+        "legacy_inspect_pow_expressions/pow_calls": (legacy_inspect_pow_expressions, lambda: pow_calls),
+        "get_operand_bounds/long": (lambda expression: (get_operand_bounds(expression, caret_index, False),
+                                                        get_operand_bounds(expression, caret_index, True)),
+                                    lambda: long_expression),
+        "update_expression_container/slots": (update_expression_container, lambda: generate_text_join(101 * scale)),
+        "rewrite_activity_xml/document": (lambda document: rewrite_activity_xml(document, "draw_expr"),
+                                          lambda: generate_activity_document(100 * scale)),
+    }
+
+def run_benchmarks(scale : int, repeat : int, selected : str | None) -> dict:
+    rewrite_cache.max_size = 0  # every run should do the rewriting, not look up the previous run's results
+    results : dict = {}
+    for name, (run, make_argument) in get_benchmarks(scale).items():
+        if selected is not None and name.find(selected) == -1: continue
+        # arguments are made up front so building them (and copying xml that gets modified) isn't timed
+        results[name] = measure(run, [make_argument() for _ in range(0, repeat + 1)])
+        print(name + ": " + "{:.3f}".format(results[name]["seconds"] * 1000) + " ms, " +
+              "{:.1f}".format(results[name]["peak_kb"]) + " kb peak")
+    return results
+
+# returns the names of benchmarks which got slower or used more memory than the baseline allows
+def find_regressions(results : dict, baseline : dict, threshold : float) -> list[str]:
+    regressions : list[str] = []
+    for name, result in results.items():
+        if name not in baseline: continue
+        for measurement in ["seconds", "peak_kb"]:
+            previous = baseline[name][measurement]
+            if previous > 0 and result[measurement] / previous > threshold:
+                regressions.append(name + " " + measurement + ": " + "{:.4g}".format(previous) + " -> " +
+                                   "{:.4g}".format(result[measurement]))
+    return regressions
+
+def parse_args():
+    parser = ArgumentParser("Benchmarks")
+    parser.add_argument("--scale",
+                        help="Multiplier for the size of every generated input.",
+                        type=int,
+                        default=1,
+                        required=False)
+    parser.add_argument("--repeat",
+                        help="The number of timed runs per benchmark.",
+                        type=int,
+                        default=20,
+                        required=False)
+    parser.add_argument("--only",
+                        help="Only run benchmarks whose name contains this text.",
+                        type=str,
+                        required=False)
+    parser.add_argument("--baseline",
+                        help="The baseline file to compare against or save to.",
+                        type=str,
+                        default=append_cur_dir("Logging", "benchmark_baseline.json"),
+                        required=False)
+    parser.add_argument("--save-baseline",
+                        help="Store these results as the new baseline instead of comparing against it.",
+                        action="store_true",
+                        required=False)
+    parser.add_argument("--threshold",
+                        help="How many times slower (or larger) than the baseline counts as a regression.",
+                        type=float,
+                        default=1.25,
+                        required=False)
+
+    return parser.parse_args()
+
+def benchmarks() -> int:
+    args = parse_args()
+    results = run_benchmarks(args.scale, args.repeat, args.only)
+
+    # baselines are only comparable for the same input sizes
+    key = "scale " + str(args.scale)
+    stored : dict = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            stored = json.load(baseline_file)
+
+    if args.save_baseline:
+        stored[key] = stored.get(key, {}) | results
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(stored, baseline_file, indent=2)
+        print("Saved baseline to " + args.baseline)
+        return 0
+
+    if key not in stored:
+        print("No baseline stored for " + key + "; run with --save-baseline to create one.")
+        return 0
+
+    regressions = find_regressions(results, stored[key], args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    print(str(len(regressions)) + " regressions against " + args.baseline)
+    return 1 if len(regressions) > 0 else 0
+
+if __name__ == '__main__':
+    exit(benchmarks())
@@ -0,0 +1,50 @@
+import json
+import threading
+
+from Utils import *
+
+# the links a read-only plan run found needing changes, along with what it found, so an apply run only visits those
+class ChangePlan:
+    def __init__(self, location : str = append_cur_dir("Logging", "change_plan.jsonl")):
+        self.location : str = location
+        self.lock = threading.Lock()
+        self.entries : dict[tuple[str, str, str, str], dict] = {}  # (action, info, link, descriptor) -> entry
+
+        if os.path.exists(location):
+            with open(location, 'r') as plan:
+                for line in plan:
+                    if line.strip() == "": continue
+                    entry = json.loads(line)
+                    self.entries[(entry["action"], entry["info"], entry["link"], entry["descriptor"])] = entry
+
+    # drops everything planned for this action and info, before planning it again
+    def clear(self, action_name : str, target_info : str):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == action_name and key[1] == target_info]:
+                self.entries.pop(key)
+            self.write()
+
+    def add(self, action_name : str, target_info : str, link : str, descriptor : str, changes : dict):
+        with self.lock:
+            self.entries[(action_name, target_info, link, descriptor)] = {
+                "action": action_name, "info": target_info, "link": link, "descriptor": descriptor,
+                "changes": changes}
+            self.write()
+
+    # removes a link once its changes have been applied
+    def resolve(self, action_name : str, target_info : str, link : str, descriptor : str):
+        with self.lock:
+            if self.entries.pop((action_name, target_info, link, descriptor), None) is not None: self.write()
+
+    # the (link, descriptor) pairs planned for this action and info, in the order they were planned
+    def get_links(self, action_name : str, target_info : str) -> list[tuple[str, str]]:
+        with self.lock:
+            return [(key[2], key[3]) for key in self.entries if key[0] == action_name and key[1] == target_info]
+
+    # replaces the file as a whole so it is never left half written
+    def write(self):
+        temp_location = self.location + ".tmp"
+        with open(temp_location, 'w') as plan:
+            for entry in self.entries.values():
+                plan.write(json.dumps(entry) + "\n")
+        os.replace(temp_location, self.location)
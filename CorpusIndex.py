@@ -0,0 +1,223 @@
+import hashlib
+import sqlite3
+import threading
+from argparse import ArgumentParser
+from time import time
+
+from Utils import *
+
+# bumped whenever what gets indexed changes, so an index built the old way is emptied and built up again
+index_version : int = 2
+
+# the length of the text grams the field index is built from; shorter searches scan the matching fields instead
+gram_length : int = 3
+
+# the distinct grams of a piece of text, for looking fields up by what they contain
+def get_grams(text : str) -> set[str]:
+    return {text[i : i + gram_length] for i in range(0, len(text) - gram_length + 1)}
+
+# an on-disk index of exported activity xml, keyed by export file name (see get_export_file_name). It records which
+# block types each document uses, and every field's text along with each (block type, value name) it is nested in,
+# so a sweep can tell which activities contain what it rewrites without opening them
+class CorpusIndex:
+    def __init__(self, location : str = append_cur_dir("Logging", "corpus.db")):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(location, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, file TEXT UNIQUE, "
+                                    "fingerprint TEXT, indexed REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS block_types (document_id INTEGER, block_type TEXT, "
+                                    "count INTEGER)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS fields (id INTEGER PRIMARY KEY, document_id INTEGER, "
+                                    "block_id TEXT, block_type TEXT, field_name TEXT, text TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS field_containers (field_id INTEGER, block_type TEXT, "
+                                    "value_name TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS grams (gram TEXT, field_id INTEGER)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS block_types_by_type ON block_types (block_type)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS block_types_by_document ON block_types (document_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS fields_by_document ON fields (document_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS containers_by_value ON field_containers "
+                                    "(value_name, field_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS containers_by_field ON field_containers (field_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS grams_by_gram ON grams (gram, field_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS grams_by_field ON grams (field_id)")
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != index_version:
+                for table in ["documents", "block_types", "fields", "field_containers", "grams"]:
+                    self.connection.execute("DELETE FROM " + table)
+                self.connection.execute("PRAGMA user_version = " + str(index_version))
+
+    # indexes (or re-indexes) the xml of one document, doing nothing if it is unchanged. Returns if anything changed
+    def add(self, file_name : str, xml_text : str | bytes) -> bool:
+        if isinstance(xml_text, str): xml_text = xml_text.encode()
+        fingerprint = hashlib.sha256(xml_text).hexdigest()
+        with self.lock:
+            stored = self.connection.execute("SELECT id, fingerprint FROM documents WHERE file = ?",
+                                             (file_name,)).fetchone()
+            if stored is not None and stored[1] == fingerprint: return False
+
+        root = etree.fromstring(xml_text, etree.XMLParser(remove_blank_text=True))
+        block_counts : dict[str, int] = {}
+        fields : list[tuple[str, str, str, str, list[tuple[str, str]]]] = []
+        for element in root.iter():
+            if not isinstance(element.tag, str): continue  # comments and such
+            tag = etree.QName(element).localname
+            if tag == "block" or tag == "shadow":
+                block_type = element.get("type", "")
+                block_counts[block_type] = block_counts.get(block_type, 0) + 1
+            elif tag == "field" and element.text is not None:
+                block = element.getparent()
+                fields.append((block.get("id", ""), block.get("type", ""), element.get("name", ""), element.text,
+                               get_value_containers(element)))
+
+        with self.lock, self.connection:
+            if stored is not None: self.remove_document(stored[0])
+            document_id = self.connection.execute("INSERT OR REPLACE INTO documents (file, fingerprint, indexed) "
+                                                  "VALUES (?, ?, ?)", (file_name, fingerprint, time())).lastrowid
+            self.connection.executemany("INSERT INTO block_types VALUES (?, ?, ?)",
+                                        [(document_id, block_type, count) for block_type, count in block_counts.items()])
+            for block_id, block_type, field_name, text, containers in fields:
+                field_id = self.connection.execute("INSERT INTO fields (document_id, block_id, block_type, field_name, "
+                                                   "text) VALUES (?, ?, ?, ?, ?)",
+                                                   (document_id, block_id, block_type, field_name, text)).lastrowid
+                self.connection.executemany("INSERT INTO field_containers VALUES (?, ?, ?)",
+                                            [(field_id, container[0], container[1]) for container in containers])
+                self.connection.executemany("INSERT INTO grams VALUES (?, ?)",
+                                            [(gram, field_id) for gram in get_grams(text)])
+        return True
+
+    def remove_document(self, document_id : int):
+        field_ids = "SELECT id FROM fields WHERE document_id = ?"
+        self.connection.execute("DELETE FROM grams WHERE field_id IN (" + field_ids + ")", (document_id,))
+        self.connection.execute("DELETE FROM field_containers WHERE field_id IN (" + field_ids + ")", (document_id,))
+        self.connection.execute("DELETE FROM fields WHERE document_id = ?", (document_id,))
+        self.connection.execute("DELETE FROM block_types WHERE document_id = ?", (document_id,))
+        self.connection.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    # every document in the index
+    def get_files(self) -> set[str]:
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT file FROM documents")}
+
+    # the documents using a block type (or any type containing it, with partial set)
+    def find_by_block_type(self, block_type : str, partial : bool = False) -> set[str]:
+        condition = "instr(b.block_type, ?) > 0" if partial else "b.block_type = ?"
+        with self.lock:
+            return {row[0] for row in self.connection.execute(
+                "SELECT DISTINCT d.file FROM block_types b JOIN documents d ON d.id = b.document_id WHERE " + condition,
+                (block_type,))}
+
+    # the (file, block id, field text) of every field containing any of the texts. With container_type and value_name,
+    # only fields nested in that value of a block whose type contains container_type count, which is how the rewriter
+    # finds its expressions
+    def find_fields(self, texts : list[str], container_type : str | None = None,
+                    value_name : str | None = None) -> list[tuple[str, str, str]]:
+        results : list[tuple[str, str, str]] = []
+        with self.lock:
+            for text in texts:
+                query = "SELECT DISTINCT d.file, f.block_id, f.text FROM fields f JOIN documents d ON d.id = f.document_id"
+                conditions = ["instr(f.text, ?) > 0"]
+                parameters : list = [text]
+                if container_type is not None or value_name is not None:
+                    query += " JOIN field_containers c ON c.field_id = f.id"
+                    if container_type is not None:
+                        conditions.append("instr(c.block_type, ?) > 0")
+                        parameters.append(container_type)
+                    if value_name is not None:
+                        conditions.append("c.value_name = ?")
+                        parameters.append(value_name)
+
+                # narrow down to the fields holding every gram of the text before checking the text itself
+                grams = sorted(get_grams(text))
+                for gram in grams:
+                    conditions.append("f.id IN (SELECT field_id FROM grams WHERE gram = ?)")
+                    parameters.append(gram)
+
+                results.extend(self.connection.execute(query + " WHERE " + " AND ".join(conditions), parameters))
+
+        return sorted(set(results))
+
+    # the documents with a field containing any of the texts (see find_fields)
+    def find_files(self, texts : list[str], container_type : str | None = None, value_name : str | None = None) -> set[str]:
+        return {result[0] for result in self.find_fields(texts, container_type, value_name)}
+
+# the (block type, value name) of every value the element is nested in, paired with every block that value is nested
+# in, innermost first. The value does not have to be a direct input of the block, the same as for expression_value_xpath
+def get_value_containers(element) -> list[tuple[str, str]]:
+    containers : list[tuple[str, str]] = []
+    value_names : list[str] = []  # the values between the element and the ancestor being looked at
+    for ancestor in element.iterancestors():
+        if not isinstance(ancestor.tag, str): continue
+        tag = etree.QName(ancestor).localname
+        if tag == "value":
+            value_names.append(ancestor.get("name", ""))
+        elif tag == "block":
+            for value_name in value_names:
+                if (ancestor.get("type", ""), value_name) not in containers:
+                    containers.append((ancestor.get("type", ""), value_name))
+    return containers
+
+# the texts which mark an expression the pow rewriter might change
+pow_marker_texts : list[str] = ["^", "pow"]
+
+# the documents whose targeted expressions (see rewrite_activity_xml) could need rewriting
+def find_pow_candidates(index : CorpusIndex, target_expression : str) -> set[str]:
+    return index.find_files(pow_marker_texts, target_expression, get_target_input_name(target_expression))
+
+def parse_args():
+    parser = ArgumentParser("CorpusIndex")
+    parser.add_argument("--build",
+                        help="A directory or tarball of exported activity xml files to add to the index.",
+                        type=str,
+                        required=False)
+    parser.add_argument("--type",
+                        help="List the documents using this block type.",
+                        type=str,
+                        required=False)
+    parser.add_argument("--text",
+                        help="List the fields containing this text.",
+                        type=str,
+                        required=False)
+    parser.add_argument("--container",
+                        help="Only count fields nested in a block whose type contains this (with --text).",
+                        type=str,
+                        required=False)
+    parser.add_argument("--value",
+                        help="Only count fields nested in the value with this name (with --text).",
+                        type=str,
+                        required=False)
+    parser.add_argument("--pow",
+                        help="List the documents whose expressions for this block type could need the pow rewrite.",
+                        type=str,
+                        required=False)
+    return parser.parse_args()
+
+def corpus_index_main():
+    args = parse_args()
+    index : CorpusIndex = CorpusIndex()
+
+    if args.build is not None:
+        from BatchTransformer import collect_activity_files  # pulls in multiprocessing, which queries don't need
+
+        start = time()
+        changed = 0
+        files = collect_activity_files(args.build)
+        for name, contents in files:
+            if isinstance(contents, str):
+                with open(contents, 'rb') as file: contents = file.read()
+            # runs look documents up by get_export_file_name, which is also what runs name their Results files
+            if index.add(os.path.basename(name), contents): changed += 1
+        print("Indexed " + str(len(files)) + " files (" + str(changed) + " new or changed) in " +
+              "{:.2f}".format(time() - start) + "s")
+
+    if args.type is not None:
+        for file_name in sorted(index.find_by_block_type(args.type)): print(file_name)
+
+    if args.text is not None:
+        for file_name, block_id, text in index.find_fields([args.text], args.container, args.value):
+            print(file_name + "\t" + block_id + "\t" + text)
+
+    if args.pow is not None:
+        for file_name in sorted(find_pow_candidates(index, args.pow)): print(file_name)
+
+if __name__ == '__main__':
+    corpus_index_main()
@@ -1,27 +1,91 @@
-from math import ceil
 
 from selenium.webdriver import ActionChains
 
 from SeleniumUtils import *
-from time import sleep
+from time import sleep, time
+
+# script which reads everything the helpers need to know about the open activity page at once, so nothing has to
+# wait out a timeout to find out that something is not there
+page_state_js : str = """
+var find_all = function (xpath) {
+    var result = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var elements = [];
+    for (var i = 0; i < result.snapshotLength; i++) elements.push(result.snapshotItem(i));
+    return elements;
+};
+var is_open = function (id) {
+    // boards have style="prop1:state; ...; visibility:hidden" if not opened
+    var board = document.getElementById(id);
+    return board !== null && (board.getAttribute('style') || '').indexOf('hidden') === -1;
+};
+
+var models = [];
+var robots = find_all("//li[contains(@class, 'robotItem relative') and not(contains(@class, 'hide'))]");
+for (var i = 0; i < robots.length; i++) {
+    var image = robots[i].querySelector('button img');
+    var src = image ? image.getAttribute('src') || '' : '';
+    models.push(src.substring(34, src.length - 4));  // exclude .png from model name
+}
+
+// the robot panel is filled in by the page's own scripts, possibly after the rest is ready. It counts as filled in once
+// every robot shows its model, or, for activities without robots, once the page has loaded and the empty list has
+// stayed empty for a moment
+if (window.robot_count !== models.length) {
+    window.robot_count = models.length;
+    window.robot_count_since = Date.now();
+}
+var robots_read = models.every(function (model) { return model !== ''; });
+var robots_filled = models.length > 0 ? robots_read :
+                    document.readyState === 'complete' && Date.now() - window.robot_count_since >= 500;
+
+var save_choice = null;
+if (find_all("//div[@class='jconfirm-buttons']/button[contains(text(), 'Update Lesson')]").length > 0) save_choice = 'lesson';
+else if (find_all("//div[@class='jconfirm-buttons']/button[contains(text(), 'Update Activity')]").length > 0) save_choice = 'activity';
+
+var gui_button = document.getElementById('guiButton');
+if (!window.page_token) window.page_token = Date.now() + '-' + Math.random();  // gone once the page is navigated away
+return {
+    'page_token': window.page_token,
+    // the parts of an activity we work with: the workspace, the robot panel (with its robots) and the save tabs
+    'ready': document.readyState !== 'loading' && typeof Blockly !== 'undefined' &&
+             document.querySelector('svg.blocklySvg .blocklyBlockCanvas') !== null &&
+             document.getElementById('robotCollapseButton') !== null && robots_filled &&
+             document.getElementById('saveTab') !== null,
+    'prompt': find_all("//div[@class='jconfirm-buttons']/button[text()='Close']").length > 0,
+    'robot_models': models,
+    'save_choice': save_choice,
+    'open_board': is_open('preBoard') ? 'preBoard' : (is_open('postBoard') ? 'postBoard' : null),
+    'min_view': gui_button !== null && gui_button.hasAttribute('disabled')
+};
+"""
+
+# reports, in one script call, a token which changes whenever the page is (re)loaded, whether a prompt is up, the
+# models of the robots, which update button the save menu offers ('lesson', 'activity' or None), which board is open
+# and whether min view is on. With wait_ready, it first waits (up to the timeout) for the activity page to be ready to
+# work with, which must not be the document with stale_token (the page being navigated away from)
+def probe_page_state(driver : WebDriver, wait_ready : bool = False, timeout=global_timeout,
+                     stale_token : str | None = None) -> dict:
+    def is_ready(state : dict) -> bool:
+        return state["ready"] and state["page_token"] != stale_token
+
+    state : dict = driver.execute_script(page_state_js)
+    if not wait_ready or is_ready(state): return state
+
+    def get_ready_state(d):
+        curr_state = d.execute_script(page_state_js)
+        return curr_state if is_ready(curr_state) else False
 
-# returns the name of the board, or None if neither board is open
-def determine_board_type(driver : WebDriver):
-    # has style attribute: style="prop1:state; ...; visibility:hidden" if not opened
-    is_pre_vis = wait_and_get(driver, "preBoard", By.ID).get_attribute("style").find("hidden") == -1
-    if is_pre_vis: return "preBoard"
-
-    is_post_vis = wait_and_get(driver, "postBoard", By.ID).get_attribute("style").find("hidden") == -1
-    if is_post_vis: return "postBoard"
-
-    return None
+    try:
+        return WebDriverWait(driver, timeout).until(get_ready_state)
+    except TimeoutException:
+        return driver.execute_script(page_state_js)  # report the state as it is
 
 def open_board(driver : WebDriver, is_preboard : bool) -> bool:
     board_name = get_board_id(is_preboard)
-    is_min_view : bool = wait_and_get(driver, 'guiButton', By.ID).get_attribute("disabled") is not None
+    is_min_view : bool = probe_page_state(driver)["min_view"]
     if is_min_view: goto_and_click(driver, "minView", By.ID)
     goto_and_click(driver, "editBoard", By.ID)
-    sleep(0.5)  # let the window actually pop up
+    wait_for_stable(driver, wait_for_vis(driver, board_name, By.NAME))  # let the window finish popping up
     goto_and_click(driver, board_name, By.NAME)
     return is_min_view
 
@@ -34,156 +98,6 @@ def close_board(driver : WebDriver, is_preboard : bool):
 
     goto_and_click(driver, close_id, By.ID)
 
-# returns the xpath id for any descendant of the type of board supplied
-def board_descendant_prefix(board_type : str):
-    return "//div[@id='" + board_type + "']/descendant::"
-
-# returns list containing vertical and horizontal scroll range, respectively
-def get_scrolls(driver):
-    # we may need to get different scrolls wheels depending on the board open
-    board_type = determine_board_type(driver)
-    ancestor_string = "//"
-    if board_type is not None:
-        ancestor_string = board_descendant_prefix(board_type)
-
-    # ensure access to vert scroll
-    vert_scroll = wait_and_get(driver, ancestor_string + "*[name()='g' and @class='blocklyScrollbarVertical']",
-                                       By.XPATH)
-
-    # ensure access to horizontal scroll
-    hori_scroll = wait_and_get(driver, ancestor_string + "*[name()='g' and @class='blocklyScrollbarHorizontal']",
-                                       By.XPATH)
-
-    return [vert_scroll, hori_scroll]
-
-# returns a list containing the vertical and horizontal scroll handles, respectively
-def get_scroll_handles(driver, scrolls: list[WebElement] | None = None):
-    if scrolls is None: scrolls = get_scrolls(driver)
-
-    vert_scroll = scrolls[0]
-    hori_scroll = scrolls[1]
-
-    vert_handle = vert_scroll.find_element(By.XPATH, "./*[name()='rect' and @class='blocklyScrollbarHandle']")
-    hori_handle = hori_scroll.find_element(By.XPATH, "./*[name()='rect' and @class='blocklyScrollbarHandle']")
-
-    return [vert_handle, hori_handle]
-
-def get_y_trans(element : WebElement):
-    element_transform = element.get_attribute("transform")
-    return float(element_transform[element_transform.find(',') + 1: element_transform.find(')')])
-
-def get_x_trans(element : WebElement):
-    element_transform = element.get_attribute("transform")
-    return float(element_transform[element_transform.find('(') + 1 : element_transform.find(',')])
-
-# controls the navigation of the blockly workspace
-# works off of the link currently open in the driver
-class BlocklyWorkspace:
-    def characterize_workspace(self, driver):
-        # ensure access to vert scroll
-        scrolls = get_scrolls(driver)
-        vert_scroll = scrolls[0]
-        hori_scroll = scrolls[1]
-
-        handles = get_scroll_handles(driver, scrolls)
-        vert_handle = handles[0]
-        hori_handle = handles[1]
-
-        ensure_in_view(driver, vert_handle)
-        ensure_in_view(driver, hori_handle)
-
-        y_top = vert_scroll.location["y"]
-        x_left = hori_scroll.location["x"]
-        y_bot = hori_scroll.location["y"] # y_top + vert_scroll.size["height"]
-        x_right = vert_scroll.location["x"] # x_left + hori_scroll.size["width"]
-
-        # scroll to edges for both bars
-        # negative offset is up for y, left for x
-        y_offset = y_bot - (float(vert_handle.get_attribute("y")) + y_top + ceil(vert_handle.rect["height"] / 2))
-        x_offset = x_right - (float(hori_handle.get_attribute("x")) + x_left + ceil(hori_handle.rect["width"] / 2))
-        ActionChains(driver).click_and_hold(vert_handle).move_by_offset(0, y_offset).release().perform()
-        ActionChains(driver).click_and_hold(hori_handle).move_by_offset(x_offset, 0).release().perform()
-
-        # record the max values
-        self.y_max = float(vert_handle.get_attribute("y"))
-        self.x_max = float(hori_handle.get_attribute("x"))
-
-        canvas = wait_and_get(driver, "//*[name()='g' and @class='blocklyBlockCanvas']", By.XPATH)
-        self.canvasTL_edge_y: float = get_y_trans(canvas)
-        self.canvasTL_edge_x: float = get_x_trans(canvas)
-
-        # reset back to 0, 0
-        ActionChains(driver).click_and_hold(vert_handle).move_by_offset(0, -int(self.y_max)).release().perform()
-        ActionChains(driver).click_and_hold(hori_handle).move_by_offset(-int(self.x_max), 0).release().perform()
-
-        self.canvasTL_origin_y: float = get_y_trans(canvas)
-        self.canvasTL_origin_x: float = get_x_trans(canvas)
-
-        canvas_y_range: float = self.canvasTL_origin_y - self.canvasTL_edge_y
-        canvas_x_range: float = self.canvasTL_origin_x - self.canvasTL_edge_x
-
-        self.scroll_per_height = self.y_max / canvas_y_range  # canvas.rect["height"]
-        self.scroll_per_width = self.x_max / canvas_x_range  # canvas.rect["width"]
-
-    def __init__(self, driver):
-        self.y_max: float = 0
-        self.x_max: float = 0
-        self.canvasTL_origin_y: float = 0
-        self.canvasTL_origin_x : float = 0
-        self.canvasTL_edge_y: float = 0
-        self.canvasTL_edge_x : float = 0
-        self.scroll_per_height: float = 0
-        self.scroll_per_width : float = 0
-        self.characterize_workspace(driver)
-
-    def scroll_to(self, driver : WebDriver, element : WebElement):
-        y_shift = 0
-        x_shift = 0
-
-        # go past all non blocklyDraggable parents
-        parent = element
-        while parent.get_attribute("class") != "blocklyDraggable":
-            # try to add the translation if present
-            if parent.get_attribute("transform") is not None:
-                y_shift += get_y_trans(parent)
-                x_shift += get_x_trans(parent)
-            parent = parent.find_element(By.XPATH, "./..")
-
-        # start collecting translation data
-        y_shift += get_y_trans(parent)
-        x_shift += get_x_trans(parent)
-
-        # determine total shift
-        # collect shifts from all draggable parents (stops at canvas level)
-        parent = parent.find_element(By.XPATH, "./..")
-        while parent.get_attribute("class") == "blocklyDraggable":
-            y_shift += get_y_trans(parent)
-            x_shift += get_x_trans(parent)
-            parent = parent.find_element(By.XPATH, "./..")
-
-        # the scroll bar elements store information
-        scrolls = get_scrolls(driver)
-        vert_scroll = scrolls[0]
-        hori_scroll = scrolls[1]
-
-        # the handles are used for interaction
-        handles = get_scroll_handles(driver, scrolls)
-        vert_handle = handles[0]
-        hori_handle = handles[1]
-
-        ensure_in_view(driver, vert_handle)
-        ensure_in_view(driver, hori_handle)
-
-        curr_y_offset : float = float(get_y_trans(vert_scroll))
-        curr_x_offset : float = float(get_x_trans(hori_scroll))
-
-        y_offset = int(y_shift * self.scroll_per_height - curr_y_offset)
-        x_offset = int(x_shift * self.scroll_per_width - curr_x_offset)
-
-        # try to navigate to element
-        ActionChains(driver).click_and_hold(vert_handle).move_by_offset(0, y_offset).release().perform()
-        ActionChains(driver).click_and_hold(hori_handle).move_by_offset(x_offset,0).release().perform()
-
 def is_logged_in(driver):
     try:
         # locate socket connection status which only appears on login and see if its good
@@ -195,10 +109,44 @@ def is_logged_in(driver):
 
     return True
 
-def ensure_logged_in(driver):
+# script which calls back with true as soon as the connection status shows a good connection, which only appears once
+# logged in, or with false after arguments[0] milliseconds
+login_js : str = """
+var timeout = arguments[0];
+var done = arguments[arguments.length - 1];
+var is_connected = function () {
+    var status = document.getElementById('socketConnectionStatus');
+    return status !== null && status.offsetParent !== null && status.getAttribute('class') === 'fa fa-circle text-lime';
+};
+if (is_connected()) { done(true); return; }
+
+var timer = null;
+var observer = new MutationObserver(function () {
+    if (!is_connected()) return;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(true);
+});
+observer.observe(document.documentElement, {attributes: true, childList: true, subtree: true});
+timer = setTimeout(function () { observer.disconnect(); done(false); }, timeout);
+"""
+
+def ensure_logged_in(driver, can_wait : bool = True):
+    # nobody can log in to a headless browser, so there is nothing to wait for there
+    if not can_wait:
+        if not is_logged_in(driver):
+            raise ValueError("This browser profile is not logged in; log in to it once without --fast first.")
+        return
+
     print("Waiting for user to login...")
-    while not is_logged_in(driver):
-        sleep(1)
+    start = time()
+    is_connected = False
+    while not is_connected:
+        try:
+            is_connected = driver.execute_async_script(login_js, 20000)
+        except Exception as error:
+            pass  # logging in navigates the page, which stops the script; just watch the new page
+    record_wait("login", time() - start)
     print("User login detected.")
 
 # downloads activity by opening save tab and then hitting save
@@ -208,6 +156,129 @@ def download_activity(driver : WebDriver, board_index : int):
     goto_and_click(driver, save_id, By.ID)
     goto_and_click(driver, "//div[@class=\'jconfirm-buttons\']/button[text()=\'Save\']", By.XPATH)
 
+# script snippet which finds the blockly workspace of the board id in arguments[0] (null for the main workspace)
+# and stores it in ws. Every workspace sits in a div with id content_blocks, with the boards' inside their board div
+workspace_lookup_js : str = """
+var board = arguments[0];
+var workspaces = Blockly.Workspace.getAll ? Blockly.Workspace.getAll() : Object.values(Blockly.Workspace.WorkspaceDB_ || {});
+var ws = null;
+for (var i = 0; i < workspaces.length && ws === null; i++) {
+    var candidate = workspaces[i];
+    if (candidate.isFlyout || candidate.isMutator || !candidate.getParentSvg) continue;
+    var svg = candidate.getParentSvg();
+    if (!svg || !svg.parentNode || svg.parentNode.id !== 'content_blocks') continue;
+    var board_div = svg.closest('#preBoard, #postBoard');
+    if ((board_div === null && board === null) || (board_div !== null && board_div.id === board)) ws = candidate;
+}
+"""
+
+# gets the id of the board a save/load index refers to, or None for the main workspace
+def get_board_id_by_index(board_index : int):
+    if board_index == 1: return None
+    return get_board_id(board_index == 2)
+
+# returns the xml text of the open activity's workspace for the given board index, or None if it can't be read
+def export_workspace_xml(driver : WebDriver, board_index : int) -> str | None:
+    try:
+        return driver.execute_script(workspace_lookup_js +
+                                     "return ws ? Blockly.Xml.domToText(Blockly.Xml.workspaceToDom(ws)) : null;",
+                                     get_board_id_by_index(board_index))
+    except Exception as error:
+        print("Failed to export the workspace: ", error)
+        return None
+
+# returns [block id, field name, value] for every editable text field of the expression blocks next to a label containing
+# arguments[1], matching the blocks replace_pow_interactive used to find on screen: the expression block is the furthest
+# right block plugged into the labelled block
+expression_fields_js : str = workspace_lookup_js + """
+var target = arguments[1];
+var fields = [];
+if (ws === null) return null;
+
+var blocks = ws.getAllBlocks(false);
+for (var i = 0; i < blocks.length; i++) {
+    var is_target = false;
+    var expression_block = null;
+    for (var j = 0; j < blocks[i].inputList.length; j++) {
+        var input = blocks[i].inputList[j];
+        for (var k = 0; k < input.fieldRow.length; k++) {
+            if (String(input.fieldRow[k].getText()).indexOf(target) !== -1) is_target = true;
+        }
+        if (input.connection && input.connection.targetBlock()) expression_block = input.connection.targetBlock();
+    }
+    if (!is_target || expression_block === null) continue;
+
+    for (var j = 0; j < expression_block.inputList.length; j++) {
+        var row = expression_block.inputList[j].fieldRow;
+        for (var k = 0; k < row.length; k++) {
+            if (row[k].EDITABLE && row[k].name && typeof row[k].getValue() === 'string')
+                fields.push([expression_block.id, row[k].name, row[k].getValue()]);
+        }
+    }
+}
+return fields;
+"""
+
+# sets every [block id, field name, value] in arguments[1] as one undo group, returning how many fields were set
+set_field_values_js : str = workspace_lookup_js + """
+var updates = arguments[1];
+var count = 0;
+if (ws === null) return 0;
+
+Blockly.Events.setGroup(true);
+try {
+    for (var i = 0; i < updates.length; i++) {
+        var block = ws.getBlockById(updates[i][0]);
+        if (block === null) continue;
+        block.setFieldValue(updates[i][2], updates[i][1]);
+        count++;
+    }
+} finally {
+    Blockly.Events.setGroup(false);
+}
+return count;
+"""
+
+# gets (block id, field name, value) of each editable text field of the blocks labelled with target_expression on the
+# given board id (None for the main workspace), or None if the workspace could not be found
+def get_expression_fields(driver : WebDriver, board_id : str | None, target_expression : str) -> list[tuple[str, str, str]] | None:
+    fields = driver.execute_script(expression_fields_js, board_id, target_expression)
+    if fields is None: return None
+    return [(field[0], field[1], field[2]) for field in fields]
+
+# sets the values of the given (block id, field name, value) fields in one call, returning how many were set
+def set_field_values(driver : WebDriver, board_id : str | None, updates : list[tuple[str, str, str]]) -> int:
+    if len(updates) == 0: return 0
+    return driver.execute_script(set_field_values_js, board_id, [list(update) for update in updates])
+
+# starts listening for a change to the blocks of the workspace of the board id (None for the main workspace), returning
+# False if the workspace could not be found
+def watch_workspace_changes(driver : WebDriver, board_id : str | None) -> bool:
+    return driver.execute_script(workspace_lookup_js + """
+        if (ws === null) return false;
+        window.workspace_changed = false;
+        var listener = function (event) {
+            if (event.isUiEvent) return;  // selection, scrolling and such don't change the blocks
+            window.workspace_changed = true;
+            ws.removeChangeListener(listener);
+        };
+        ws.addChangeListener(listener);
+        return true;
+    """, board_id)
+
+# waits until the workspace watched by watch_workspace_changes fires a change to its blocks
+def wait_for_workspace_change(driver : WebDriver, timeout=global_timeout):
+    timed_wait(driver, "workspace change", lambda d: d.execute_script("return window.workspace_changed === true;"),
+               timeout)
+
+# gives the file straight to the named file input (or the one inside/after it), as if it was picked in the file dialog
+def upload_to_file_input(driver : WebDriver, input_name : str, file_location : str):
+    file_input = wait_and_get(driver, input_name, By.NAME)
+    if file_input.tag_name != "input" or file_input.get_attribute("type") != "file":
+        file_input = file_input.find_element(By.XPATH,
+            "./descendant-or-self::input[@type='file'] | ./following::input[@type='file'][1]")
+    file_input.send_keys(file_location)
+
 # performs the actions necessary to save, but does not clean up save menu (leaves it open)
 def save_activity(driver, is_lesson=None, board_index : int=1):
     save_tab_id : str = "saveTab"
@@ -215,19 +286,12 @@ def save_activity(driver, is_lesson=None, board_index : int=1):
     goto_and_click(driver, save_tab_id, by_val=By.ID)  # open the save menu
 
     if is_lesson is None:
-        try:
-            # we try to quickly cause a throw if this is not a lesson
-            wait_and_get(driver, "//div[@class=\'jconfirm-buttons\']/button[contains(text(), \'Update Lesson\')]",
-                         by_val=By.XPATH, timeout=1)
-            print("This is a lesson")
-            goto_and_click(driver, "//div[@class=\'jconfirm-buttons\']/button[contains(text(), \'Update Lesson\')]",
-                           by_val=By.XPATH, timeout=5)
+        # wait for whichever update button the save menu offers instead of timing out on the lesson one first
+        save_choice = WebDriverWait(driver, global_timeout).until(lambda d: probe_page_state(d)["save_choice"])
+        is_lesson = save_choice == "lesson"
+        print("This is a lesson" if is_lesson else "This is an activity")
 
-        except Exception as error:
-            print("This is an activity")
-            goto_and_click(driver, "//div[@class=\'jconfirm-buttons\']/button[contains(text(), \'Update Activity\')]",
-                           by_val=By.XPATH)  # ideally shouldn't take very long for this to popup
-    elif is_lesson:
+    if is_lesson:
         goto_and_click(driver, "//div[@class=\'jconfirm-buttons\']/button[contains(text(), \'Update Lesson\')]",
                        by_val=By.XPATH, timeout=5)
     else:
@@ -241,10 +305,128 @@ def save_activity(driver, is_lesson=None, board_index : int=1):
 
     print("Finished submitting")
 
-    # ensure all close buttons are loaded
-    wait_for_vis(driver, "//span[@class='jconfirm-title' and text()='Success']/ancestor::*//div[@class=\'jconfirm-buttons\']/button[text()=\'Close\']",
-                  by_val=By.XPATH)  # close the confirmation prompt
+    # ensure all close buttons are loaded, the success dialog being the sign the save went through
+    timed_wait(driver, "save", EC.visibility_of_element_located((By.XPATH,
+        "//span[@class='jconfirm-title' and text()='Success']/ancestor::*//div[@class=\'jconfirm-buttons\']/button[text()=\'Close\']")))
+
+
+# script which reads every robot entry of the workspace shown, the same way get_robots selects them
+robot_inventory_js : str = """
+var result = document.evaluate("//li[contains(@class, 'robotItem relative')]", document, null,
+                               XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var entries = [];
+for (var i = 0; i < result.snapshotLength; i++) {
+    var item = result.snapshotItem(i);
+    if (item.classList.contains('hide')) continue;
+    var button = item.querySelector('button');
+    var image = button ? button.querySelector('img') : null;
+    var src = image ? image.getAttribute('src') || '' : '';
+    entries.push([item, button, src.substring(34, src.length - 4), item.offsetParent !== null]);  // exclude .png
+}
+return entries;
+"""
+
+# one robot entry of the current page or sub-target
+class RobotEntry:
+    def __init__(self, index : int, element : WebElement, button : WebElement, model : str, is_visible : bool):
+        self.index : int = index
+        self.element : WebElement = element
+        self.button : WebElement = button
+        self.model : str = model
+        self.is_visible : bool = is_visible
+
+# reads every robot entry (with its model and button) in a single script call, in order
+def get_robot_inventory(driver : WebDriver) -> list[RobotEntry]:
+    entries = driver.execute_script(robot_inventory_js)
+    return [RobotEntry(i, entries[i][0], entries[i][1], entries[i][2], entries[i][3]) for i in range(0, len(entries))]
+
+# gets the model name of every robot on the page, in order
+def get_robot_models(driver : WebDriver) -> list[str]:
+    return [entry.model for entry in get_robot_inventory(driver)]
+
+# script which goes through the model dialog of each (robot index, model) assignment in arguments[0] inside the page,
+# clicking the same controls update_model does but without a round trip per click. Calls back with an error or null.
+# It marks itself running in window.robotModelsRunning and stops before its next click once window.robotModelsCancelled
+# is set, so a caller which gave up on it can tell when the page is left alone again
+set_robot_models_js : str = """
+var assignments = arguments[0];
+var timeout = arguments[1];
+var callback = arguments[arguments.length - 1];
+window.robotModelsCancelled = false;
+window.robotModelsRunning = true;
+var done = function (error) { window.robotModelsRunning = false; callback(error); };
+var cancelled = function () {
+    if (window.robotModelsCancelled) done('Cancelled');
+    return window.robotModelsCancelled;
+};
+var result = document.evaluate("//li[contains(@class, 'robotItem relative') and not(contains(@class, 'hide'))]", document,
+                               null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var is_shown = function (element) { return element !== null && element.offsetParent !== null; };
+
+// calls then with the element once find returns a shown one (or with nothing once find returns null, if hidden is set)
+var wait_for = function (find, then, hidden) {
+    var start = Date.now();
+    var poll = function () {
+        if (cancelled()) return;
+        var element = find();
+        if (hidden ? !is_shown(element) : is_shown(element)) then(element);
+        else if (Date.now() - start > timeout) done('Timed out waiting in the robot model dialog');
+        else setTimeout(poll, 25);
+    };
+    poll();
+};
+
+var assign = function (k) {
+    if (k >= assignments.length) { done(null); return; }
+    if (cancelled()) return;
+    var index = assignments[k][0];
+    var model = assignments[k][1];
+    if (index >= result.snapshotLength) { done('There is no robot ' + (index + 1)); return; }
+
+    result.snapshotItem(index).querySelector('button').click();
+    wait_for(function () { return document.getElementById('robotModel' + (index + 1)); }, function (open_models) {
+        open_models.click();  // open model selection
+        wait_for(function () { return document.querySelector("img[value='" + model + "']"); }, function (image) {
+            image.click();  // select model
+            wait_for(function () { return document.getElementById('closeButton'); }, function (close) {
+                close.click();  // close the menu
+                wait_for(function () { return document.getElementById('closeButton'); }, function () {
+                    assign(k + 1);
+                }, true);
+            });
+        });
+    });
+};
+assign(0);
+"""
+
+# the script which tells set_robot_models_js to stop, and the one which checks whether it has
+cancel_robot_models_js : str = "window.robotModelsCancelled = true;"
+robot_models_running_js : str = "return window.robotModelsRunning === true;"
+
+# sets the model of each robot index in assignments in one script call, then reads the models back. Returns the indices
+# whose model did not end up as assigned. If the call gives up, the script is cancelled and waited on first, so it can
+# not click through a dialog while the caller goes through the same dialogs itself
+def set_robot_models(driver : WebDriver, assignments : dict[int, str], timeout=global_timeout) -> list[int]:
+    if len(assignments) == 0: return []
+
+    # each assignment waits on at most four steps of the dialog, which the script times out on by itself
+    previous_timeout = driver.timeouts.script
+    driver.set_script_timeout(timeout * (4 * len(assignments) + 1))
+    try:
+        error = driver.execute_async_script(set_robot_models_js, [[index, model] for index, model in assignments.items()],
+                                            timeout * 1000)
+        if error is not None: print("Batch model update stopped: " + error)
+    except Exception as error:
+        print("Batch model update failed: ", error)
+        driver.execute_script(cancel_robot_models_js)
+        WebDriverWait(driver, timeout, poll_frequency=0.05).until_not(
+            lambda d: d.execute_script(robot_models_running_js))
+    finally:
+        driver.set_script_timeout(previous_timeout)
 
+    models = get_robot_models(driver)
+    return [index for index, model in assignments.items() if index >= len(models) or models[index] != model]
 
 def get_robots(driver):
     # user should be logged in now
@@ -253,10 +435,7 @@ def get_robots(driver):
     if robot_tab.get_attribute("aria-expanded") == "false": robot_tab.click()  # expand if not already
 
     # in case activity does not have robot (which happens surprisingly more than a few times)
-    try:
-        wait_and_get(driver, "//li[contains(@class, 'robotItem relative') and not(contains(@class, 'hide'))]",
-                     by_val=By.XPATH, timeout=1)
-    except Exception as error:
+    if len(probe_page_state(driver, wait_ready=True)["robot_models"]) == 0:
         print("No robots in this activity; skipping")
         return None
 
@@ -265,6 +444,39 @@ def get_robots(driver):
     return robots
 
 
+# how long the number of links on the portal page has to stay the same before the list is taken as complete
+link_list_settle_time : float = 0.5
+
+# reads every (link, descriptor) listed on the portal page in one script call. With the eager or none page load
+# strategies the list can still be filling in, and a partial list would mark the missing links inactive in the link
+# store, so it waits for the page to finish loading and the number of links to stop changing
+def scrape_links(driver : WebDriver, timeout=global_timeout) -> list[tuple[str, str]]:
+    scrape_script = """
+        var anchors = document.evaluate("//div[@class='row']//a[@target='_blank']", document, null,
+                                        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        var entries = [];
+        for (var i = 0; i < anchors.snapshotLength; i++) {
+            var anchor = anchors.snapshotItem(i);
+            entries.push([anchor.href, anchor.innerText.trim()]);
+        }
+        return entries;
+    """
+    last_count : list[int] = [-1]  # the number of links the last poll found
+    def get_settled_entries(d):
+        if d.execute_script("return document.readyState;") != "complete": return None
+        entries = d.execute_script(scrape_script)
+        if len(entries) == 0 or len(entries) != last_count[0]:
+            last_count[0] = len(entries)
+            return None
+        return entries
+
+    try:
+        entries = WebDriverWait(driver, timeout, poll_frequency=link_list_settle_time).until(get_settled_entries)
+    except TimeoutException:
+        return []
+
+    return [(entry[0], entry[1].strip('\'')) for entry in entries]  # we will parse the descriptor later
+
 def select_target_type(driver, is_example, target_num):
     if target_num is not None:
         # select relevant "sub-page"
@@ -274,15 +486,186 @@ def select_target_type(driver, is_example, target_num):
             goto_and_click(driver, "loadSolution" + target_num, By.ID)
 
 
+# keeps the next links loading in background tabs of the same driver while the current link is being worked on
+class TabPrefetcher:
+    def __init__(self, driver : WebDriver, depth : int = 1):
+        self.driver : WebDriver = driver
+        self.depth : int = depth
+        self.tabs : dict[str, tuple[str, float]] = {}  # link -> (window handle, time the tab was opened)
+        self.hidden_time : float = 0
+        self.load_time : float = 0
+        self.adopted : int = 0
+
+    # opens a background tab for each link that does not have one yet, ending up back on the current tab. A driver which
+    # blocks requests opens the tab blank first, so the blocking is in place before the link starts loading
+    def prefetch(self, links : list[str]):
+        blocking = self.driver in request_blocking_drivers
+        for link in links:
+            if link in self.tabs: continue
+            prev_handles = self.driver.window_handles
+            self.driver.execute_script("window.open(arguments[0], '_blank');", "about:blank" if blocking else link)
+            new_handles = [handle for handle in self.driver.window_handles if handle not in prev_handles]
+            if len(new_handles) != 1: continue
+
+            if blocking:
+                current = self.driver.current_window_handle
+                self.driver.switch_to.window(new_handles[0])
+                apply_request_blocking(self.driver)
+                self.driver.execute_script("window.location.href = arguments[0];", link)  # unlike get, does not wait
+                self.driver.switch_to.window(current)
+            self.tabs[link] = (new_handles[0], time())
+
+    # closes the current tab and switches to the prefetched tab of the link, returning False if there is none
+    def adopt(self, link : str) -> bool:
+        if link not in self.tabs: return False
+        handle = self.tabs.pop(link)[0]
+
+        adopt_start = time()
+        self.driver.close()
+        self.driver.switch_to.window(handle)
+        apply_request_blocking(self.driver)
+        probe_page_state(self.driver, wait_ready=True, timeout=global_timeout * 6)
+        waited = time() - adopt_start
+
+        # navigation timing is relative to the start of the load, so its end is the full load time of the tab
+        load_time = self.driver.execute_script(
+            "var nav = performance.getEntriesByType('navigation')[0]; return nav ? nav.loadEventEnd / 1000 : 0;")
+        hidden = max(0.0, load_time - waited)
+        self.hidden_time += hidden
+        self.load_time += load_time
+        self.adopted += 1
+        print("Prefetched tab hid " + "{:.2f}".format(hidden) + "s of " + "{:.2f}".format(load_time) + "s page load")
+        return True
+
+    # closes every tab that was prefetched but never used
+    def close_unused(self):
+        current = self.driver.current_window_handle
+        for handle, _ in self.tabs.values():
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.tabs.clear()
+        self.driver.switch_to.window(current)
+
+    def report(self):
+        if self.adopted == 0: return
+        print("Prefetching hid " + "{:.2f}".format(self.hidden_time) + "s of " + "{:.2f}".format(self.load_time) +
+              "s of page loading over " + str(self.adopted) + " links (" +
+              "{:.2f}".format(self.hidden_time / self.adopted) + "s per link)")
+
+# the prefetcher used by each driver, if it has one
+tab_prefetchers : dict[WebDriver, TabPrefetcher] = {}
+
 def open_and_ignore_prompt(driver, link):
-    driver.get(link)
+    # use the already loaded tab if this link was prefetched
+    open_start = time()
+    stale_token = None
+    prefetcher = tab_prefetchers.get(driver)
+    if prefetcher is None or not prefetcher.adopt(link):
+        # with the eager or none page load strategies get can return while the old page is still showing
+        stale_token = driver.execute_script(page_state_js)["page_token"]
+        driver.get(link)
     # ensure_logged_in(driver)  # we can generally assume the user is already logged in
 
-    # see if there is a popup prompt we need to get rid of
-    try:
-        prompt_close = wait_for_vis(driver, "//div[@class=\'jconfirm-buttons\']/button[text()=\'Close\']",
-                                    by_val=By.XPATH, timeout=1)
+    # see if there is a popup prompt we need to get rid of, once the page is ready to work with
+    state = probe_page_state(driver, wait_ready=True, timeout=global_timeout * 6, stale_token=stale_token)
+    record_wait("time to interactive", time() - open_start)
+    print("Activity ready after " + "{:.2f}".format(time() - open_start) + "s")
+    # a prompt showing up later than this is closed by goto_and_click once it gets in the way of a click
+    if state["prompt"]:
+        prompt_close = wait_for_vis(driver, prompt_close_xpath, by_val=By.XPATH)
         prompt_close.click()
         print("A prompt was found and ignored")
-    except Exception as exception:
+    else:
         print("No prompt found")
+
+# keeps track of the activity open in a driver, so every sub-target of one activity (start blocks, examples,
+# solutions and boards) can be worked on during a single visit to its page
+class ActivitySession:
+    def __init__(self, driver : WebDriver):
+        self.driver : WebDriver = driver
+        self.activity : str | None = None  # the activity which is open and ready to work on, if any
+        self.link : str | None = None
+        self.target : str | None = None  # the example or solution number loaded in the workspace
+        self.fixup_done : bool = False
+        self.min_view_was_on : bool = False  # whether min view was on before a board was opened on this page
+        self.restore_min_view : bool = False
+        self.is_lesson = None
+        self.loads : int = 0
+        self.reuses : int = 0
+
+    # makes the activity of the link ready to work on, only loading its page if it is not already open
+    def open(self, link : str):
+        activity = get_activity_url(link)
+        if activity == self.activity:
+            self.reset()
+            self.reuses += 1
+            return
+
+        self.finish()
+        if self.link is None or get_activity_url(self.link) != activity: self.fixup_done = False
+        open_and_ignore_prompt(self.driver, link)
+        self.activity = activity
+        self.link = link
+        self.target = None
+        self.min_view_was_on = False
+        self.loads += 1
+
+    # closes what the last sub-target left open, being the save confirmation and any open board
+    def reset(self):
+        state = probe_page_state(self.driver)
+        if state["prompt"]: close_prompts(self.driver)
+
+        if state["open_board"] is not None: close_board(self.driver, state["open_board"] == "preBoard")
+
+    # opens the example or solution (or the start blocks, if target_num is None) in the workspace
+    def select_target(self, is_example, target_num):
+        # there is no button back to the start blocks, so they need a fresh page once anything else was loaded
+        if target_num is None and self.target is not None:
+            self.invalidate()
+            self.open(self.link)
+
+        select_target_type(self.driver, is_example, target_num)
+        if target_num is not None: self.target = ("Example " if is_example else "Solution ") + target_num
+
+    # opens the board, returning whether min view was on when the page loaded. Opening a board turns min view off,
+    # which stays off for the rest of the visit and only needs turning back on once something has been saved
+    def open_board(self, is_preboard : bool) -> bool:
+        if open_board(self.driver, is_preboard): self.min_view_was_on = True
+        return self.min_view_was_on
+
+    # makes the next open load the page again, for when the page was navigated away from or left in an unknown state
+    def invalidate(self):
+        self.activity = None
+
+    # asks for min view to be turned back on once every sub-target of the activity is done
+    def defer_min_view(self, is_lesson):
+        self.restore_min_view = True
+        self.is_lesson = is_lesson
+
+    # wraps up the activity, turning min view back on if a sub-target turned it off
+    def finish(self):
+        if not self.restore_min_view: return
+        self.restore_min_view = False
+        self.activity = None
+
+        stale_token = self.driver.execute_script(page_state_js)["page_token"]
+        self.driver.get(self.link)  # re-open after saving
+
+        # check that min view is not already enabled
+        state = probe_page_state(self.driver, wait_ready=True, timeout=global_timeout * 6, stale_token=stale_token)
+        if not state["min_view"]:
+            goto_and_click(self.driver, "minView", By.ID)  # click min_view
+            save_activity(self.driver, self.is_lesson, 1)  # save the activity
+
+    def report(self):
+        if self.loads == 0: return
+        print("Loaded " + str(self.loads) + " activity pages for " + str(self.loads + self.reuses) + " links (" +
+              str(self.reuses) + " handled on an already open page)")
+
+# the activity session of each driver
+activity_sessions : dict[WebDriver, ActivitySession] = {}
+
+# gets the activity session of the driver, starting one if it does not have one yet
+def get_activity_session(driver : WebDriver) -> ActivitySession:
+    if driver not in activity_sessions: activity_sessions[driver] = ActivitySession(driver)
+    return activity_sessions[driver]
@@ -0,0 +1,48 @@
+import hashlib
+import json
+import threading
+
+from Utils import *
+
+# a short hash of whatever an action looks at on a link (its workspace xml or its robot models)
+def get_fingerprint(content : str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+# the fingerprint each link had when an action last found nothing to change on it, kept across runs so a later run
+# can skip links that have not changed since
+class FingerprintStore:
+    def __init__(self, location : str = append_cur_dir("Logging", "fingerprints.json")):
+        self.location : str = location
+        self.lock = threading.Lock()
+        self.entries : dict[str, str] = {}  # action, info, link and descriptor joined by tabs -> fingerprint
+
+        if os.path.exists(location):
+            with open(location, 'r') as fingerprints:
+                self.entries = json.load(fingerprints)
+
+    @staticmethod
+    def get_key(action_name : str, target_info : str, link : str, descriptor : str) -> str:
+        return "\t".join([action_name, str(target_info), link, descriptor])
+
+    # whether the action already found nothing to change on the link while it had this fingerprint
+    def is_verified(self, action_name : str, target_info : str, link : str, descriptor : str, fingerprint : str) -> bool:
+        with self.lock:
+            return self.entries.get(self.get_key(action_name, target_info, link, descriptor)) == fingerprint
+
+    def verify(self, action_name : str, target_info : str, link : str, descriptor : str, fingerprint : str):
+        with self.lock:
+            self.entries[self.get_key(action_name, target_info, link, descriptor)] = fingerprint
+            self.write()
+
+    # forgets the fingerprint of a link the action has since changed
+    def forget(self, action_name : str, target_info : str, link : str, descriptor : str):
+        with self.lock:
+            if self.entries.pop(self.get_key(action_name, target_info, link, descriptor), None) is not None:
+                self.write()
+
+    # replaces the file as a whole so it is never left half written
+    def write(self):
+        temp_location = self.location + ".tmp"
+        with open(temp_location, 'w') as fingerprints:
+            json.dump(self.entries, fingerprints)
+        os.replace(temp_location, self.location)
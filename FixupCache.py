@@ -0,0 +1,68 @@
+import json
+import threading
+
+from Utils import *
+
+# the outcomes of a fixup attempt, as noted in PotentialOverwrites.txt
+fixup_no_source : str = "NO SOURCE"
+fixup_model_count_mismatch : str = "MODEL COUNT MISMATCH"
+fixup_no_fix : str = "NO FIX APPLIED"
+fixup_applied : str = "APPLIED FIX(es)"
+
+# the line PotentialOverwrites.txt has for a fixup outcome
+def get_fixup_note(link : str, status : str, title : str) -> str:
+    if status == fixup_no_source: return status + ": " + link + "\n"
+    return status + ": " + link + " - " + title + "\n"
+
+# the fixup outcome of every activity, kept across runs since it only depends on the activity page and not on which of
+# its entries is being processed. PotentialOverwrites.txt is written out from it
+class FixupCache:
+    def __init__(self, location : str = append_cur_dir("Logging", "fixup_cache.json"),
+                 report_location : str = append_cur_dir("PotentialOverwrites.txt"), recheck : bool = False):
+        self.location : str = location
+        self.report_location : str = report_location
+        self.recheck : bool = recheck  # whether to try every fixup again, replacing what is cached
+        self.lock = threading.Lock()
+        self.entries : dict[str, dict] = {}  # activity url -> entry
+
+        if os.path.exists(location):
+            with open(location, 'r') as cache:
+                self.entries = json.load(cache)
+        elif os.path.exists(report_location):
+            self.read_report()
+
+    # carries over the outcomes noted in a PotentialOverwrites.txt from before the cache existed
+    def read_report(self):
+        with open(self.report_location, 'r') as report:
+            for line in report:
+                for status in [fixup_no_source, fixup_model_count_mismatch, fixup_no_fix, fixup_applied]:
+                    if not line.startswith(status + ": "): continue
+                    rest = line[len(status) + 2 : len(line)].rstrip("\n")
+                    link = rest.split(" - ", 1)[0]
+                    title = rest[len(link) + 3 : len(rest)]
+                    self.entries[get_activity_url(link)] = {"link": link, "status": status, "title": title}
+                    break
+
+    # the cached outcome for the link's activity, or None if its fixup still needs to be tried
+    def get(self, link : str) -> dict | None:
+        if self.recheck: return None
+        with self.lock:
+            return self.entries.get(get_activity_url(link))
+
+    def add(self, link : str, status : str, title : str):
+        with self.lock:
+            self.entries[get_activity_url(link)] = {"link": link, "status": status, "title": title}
+            self.write()
+
+    # replaces the cache and the report as a whole so neither is left half written
+    def write(self):
+        temp_location = self.location + ".tmp"
+        with open(temp_location, 'w') as cache:
+            json.dump(self.entries, cache, indent=1)
+        os.replace(temp_location, self.location)
+
+        temp_location = self.report_location + ".tmp"
+        with open(temp_location, 'w') as report:
+            for entry in self.entries.values():
+                report.write(get_fixup_note(entry["link"], entry["status"], entry["title"]))
+        os.replace(temp_location, self.report_location)
@@ -0,0 +1,102 @@
+import hashlib
+import sqlite3
+import threading
+from time import time
+
+from Utils import *
+
+# the link lists of the portal pages, with each link's descriptor already parsed into its LinkInfo fields
+class LinkStore:
+    def __init__(self, location : str = append_cur_dir("Logging", "links.db")):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(location, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, fingerprint TEXT, "
+                                    "refreshed REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS links (source TEXT, position INTEGER, link TEXT, "
+                                    "descriptor TEXT, is_lesson INTEGER, is_pre INTEGER, is_post INTEGER, "
+                                    "is_example INTEGER, num INTEGER, active INTEGER, "
+                                    "UNIQUE (source, link, descriptor))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS links_by_source ON links (source, active, position)")
+
+    def has_source(self, source : str) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM sources WHERE source = ?", (source,)).fetchone() is not None
+
+    # brings the stored list up to date with the (link, descriptor) entries currently on the source page. Only the
+    # differences are written; links no longer on the page are kept but marked inactive. Returns if anything changed
+    def refresh(self, source : str, entries : list[tuple[str, str]]) -> bool:
+        fingerprint = hashlib.sha256("\n".join(link + "\t" + descriptor for link, descriptor in entries).encode()).hexdigest()
+        with self.lock, self.connection:
+            stored = self.connection.execute("SELECT fingerprint FROM sources WHERE source = ?", (source,)).fetchone()
+            if stored is not None and stored[0] == fingerprint: return False
+
+            existing = {(row[0], row[1]): (row[2], row[3]) for row in self.connection.execute(
+                "SELECT link, descriptor, position, active FROM links WHERE source = ?", (source,))}
+            seen : set[tuple[str, str]] = set()
+            for position in range(0, len(entries)):
+                key = entries[position]
+                if key in seen: continue  # the page lists it more than once
+                seen.add(key)
+
+                if key not in existing:
+                    link_info = LinkInfo(key[1])
+                    self.connection.execute("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                                            (source, position, key[0], key[1], link_info.is_lesson(),
+                                             link_info.is_pre(), link_info.is_post(), link_info.is_example(),
+                                             link_info.curr_info['N']))
+                elif existing[key] != (position, 1):
+                    self.connection.execute("UPDATE links SET position = ?, active = 1 WHERE source = ? AND link = ? "
+                                            "AND descriptor = ?", (position, source, key[0], key[1]))
+
+            for key, (position, active) in existing.items():
+                if key not in seen and active:
+                    self.connection.execute("UPDATE links SET active = 0 WHERE source = ? AND link = ? AND descriptor = ?",
+                                            (source, key[0], key[1]))
+
+            self.connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, fingerprint, time()))
+            return True
+
+    # the active links of the source in page order, with their info lists. Every filter left as None matches
+    # anything; board is "pre", "post" or "none", num 0 means start blocks, and numbered tells examples and solutions
+    # (which always have a number) apart from start blocks
+    def query(self, source : str, is_lesson : bool | None = None, board : str | None = None,
+              is_example : bool | None = None, num : int | None = None,
+              numbered : bool | None = None) -> tuple[list[str], list[list[str]]]:
+        conditions = ["source = ?", "active = 1"]
+        parameters : list = [source]
+        if is_lesson is not None:
+            conditions.append("is_lesson = ?")
+            parameters.append(int(is_lesson))
+        if board == "pre": conditions.append("is_pre = 1")
+        elif board == "post": conditions.append("is_post = 1")
+        elif board == "none": conditions.append("is_pre = 0 AND is_post = 0")
+        if is_example is not None:
+            conditions.append("is_example = ?")
+            parameters.append(int(is_example))
+        if num is not None:
+            conditions.append("num = ?")
+            parameters.append(num)
+        if numbered is not None: conditions.append("num > 0" if numbered else "num = 0")
+
+        with self.lock:
+            rows = self.connection.execute("SELECT link, descriptor FROM links WHERE " + " AND ".join(conditions) +
+                                           " ORDER BY position", parameters).fetchall()
+        return [row[0] for row in rows], [[row[1]] for row in rows]
+
+# reads the text cache link lists used to be stored in, as (link, descriptor) entries
+def read_link_text_cache(location : str) -> list[tuple[str, str]]:
+    entries : list[tuple[str, str]] = []
+    with open(location, 'r') as link_file:
+        lines = link_file.readlines()
+        line_count : int = 0
+        while line_count + 1 < len(lines):
+            link_line = lines[line_count]
+            info_line = lines[line_count + 1]
+            entries.append((link_line[link_line.find("]:") + 3 : len(link_line) - 1],  # ensure to drop \n
+                            info_line[info_line.find('[') + 1 : info_line.rfind(']')].strip('\'')))  # drop '
+
+            # skip the whitespace line
+            line_count += 3
+
+    return entries
@@ -0,0 +1,46 @@
+import json
+import threading
+from time import time
+
+from Utils import *
+
+# the outcomes a link can have. Actions return outcome_no_op when nothing needed changing, anything else is a success
+outcome_success : str = "success"
+outcome_no_op : str = "no-op"
+outcome_failure : str = "failure"
+
+# append-only record of every link outcome, which survives crashes and lets a later run skip completed links
+class ProgressJournal:
+    def __init__(self, location : str = append_cur_dir("Logging", "journal.jsonl")):
+        self.location : str = location
+        self.lock = threading.Lock()
+
+    def record(self, action_name : str, target_info : str, link : str, descriptor : str, outcome : str,
+               duration : float, error : str | None = None):
+        entry = {"action": action_name, "info": target_info, "link": link, "descriptor": descriptor,
+                 "outcome": outcome, "duration": round(duration, 3), "time": round(time(), 3)}
+        if error is not None: entry["error"] = error
+
+        # flushed all the way to disk, so nothing recorded is lost if the machine goes down mid-run
+        with self.lock:
+            with open(self.location, 'a') as journal:
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    # the (link, descriptor) pairs whose latest outcome for this action and info was a success or no-op
+    def get_completed(self, action_name : str, target_info : str) -> set[tuple[str, str]]:
+        latest_outcomes : dict[tuple[str, str], str] = {}
+        if not os.path.exists(self.location): return set()
+
+        with self.lock:
+            with open(self.location, 'r') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by a crash
+                    if entry["action"] != action_name or entry["info"] != target_info: continue
+                    latest_outcomes[(entry["link"], entry["descriptor"])] = entry["outcome"]
+
+        return {key for key, outcome in latest_outcomes.items() if outcome != outcome_failure}
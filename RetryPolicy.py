@@ -0,0 +1,82 @@
+import json
+import threading
+
+from selenium.common import ElementClickInterceptedException, NoSuchElementException, \
+    StaleElementReferenceException, TimeoutException
+
+from Utils import *
+
+# the kinds of error a link can fail with
+error_timeout : str = "timeout"
+error_stale_element : str = "stale element"
+error_intercepted_click : str = "intercepted click"
+error_missing_element : str = "missing element"
+error_other : str = "other"
+
+def classify_error(error : Exception) -> str:
+    if isinstance(error, TimeoutException): return error_timeout
+    if isinstance(error, StaleElementReferenceException): return error_stale_element
+    if isinstance(error, ElementClickInterceptedException): return error_intercepted_click
+    if isinstance(error, NoSuchElementException): return error_missing_element
+    return error_other
+
+# how many times a link is attempted and how long to wait between attempts
+class RetryPolicy:
+    def __init__(self, max_attempts : int = 4, base_delay : float = 1, backoff : float = 2, max_delay : float = 30):
+        self.max_attempts : int = max_attempts
+        self.base_delay : float = base_delay
+        self.backoff : float = backoff
+        self.max_delay : float = max_delay
+
+        # a missing element usually means the page is not laid out the way the action expects, which retrying
+        # rarely fixes, while stale elements and intercepted clicks are just bad timing
+        self.attempts_by_error : dict[str, int] = {error_missing_element: min(2, max_attempts)}
+
+    def should_retry(self, error_class : str, attempt : int) -> bool:
+        return attempt < self.attempts_by_error.get(error_class, self.max_attempts)
+
+    # the wait before the attempt after the given one, growing exponentially
+    def get_delay(self, error_class : str, attempt : int) -> float:
+        delay = self.base_delay * self.backoff ** (attempt - 1)
+        if error_class == error_stale_element or error_class == error_intercepted_click: delay /= 4
+        return min(delay, self.max_delay)
+
+# the links which ran out of attempts, kept so they can be re-run later as their own batch
+class DeadLetterQueue:
+    def __init__(self, location : str = append_cur_dir("Logging", "dead_letters.jsonl")):
+        self.location : str = location
+        self.lock = threading.Lock()
+        self.entries : dict[tuple[str, str, str, str], dict] = {}  # (action, info, link, descriptor) -> entry
+
+        if os.path.exists(location):
+            with open(location, 'r') as dead_letters:
+                for line in dead_letters:
+                    if line.strip() == "": continue
+                    entry = json.loads(line)
+                    self.entries[(entry["action"], entry["info"], entry["link"], entry["descriptor"])] = entry
+
+    def add(self, action_name : str, target_info : str, link : str, descriptor : str, error_class : str,
+            error : str, attempts : int):
+        with self.lock:
+            self.entries[(action_name, target_info, link, descriptor)] = {
+                "action": action_name, "info": target_info, "link": link, "descriptor": descriptor,
+                "error_class": error_class, "error": error, "attempts": attempts}
+            self.write()
+
+    # removes a link that has since succeeded
+    def resolve(self, action_name : str, target_info : str, link : str, descriptor : str):
+        with self.lock:
+            if self.entries.pop((action_name, target_info, link, descriptor), None) is not None: self.write()
+
+    # the (link, descriptor) pairs dead-lettered for this action and info, in the order they were added
+    def get_links(self, action_name : str, target_info : str) -> list[tuple[str, str]]:
+        with self.lock:
+            return [(key[2], key[3]) for key in self.entries if key[0] == action_name and key[1] == target_info]
+
+    # replaces the file as a whole so it is never left half written
+    def write(self):
+        temp_location = self.location + ".tmp"
+        with open(temp_location, 'w') as dead_letters:
+            for entry in self.entries.values():
+                dead_letters.write(json.dumps(entry) + "\n")
+        os.replace(temp_location, self.location)
@@ -0,0 +1,93 @@
+from Utils import *
+
+# expressions paired with the rewrite they should get. The last field marks the ones the legacy rewriter gets wrong
+# (or fails on), which are only checked against the expected rewrite
+rewriter_corpus : list[tuple[str, str, bool]] = [
+    # already in the desired form, or without any power
+    ("", "", False),
+    ("x+1", "x+1", False),
+    ("pow(x,2)", "pow(x,2)", False),
+    ("2*pow(x, 3) - 1", "2*pow(x, 3) - 1", False),
+    ("pow((x),2)", "pow((x),2)", False),
+
+    # single powers
+    ("x^2", "pow(x,2)", False),
+    ("x ^ 2 + 1", "pow(x,2) + 1", False),
+    ("2*x^2.5+3", "2*pow(x,2.5)+3", False),
+    ("3.14^2", "pow(3.14,2)", False),
+    ("-x^2", "-pow(x,2)", False),
+    ("2^-1", "pow(2,-1)", False),
+    ("x^ 3", "pow(x,3)", False),
+    ("t^2/2", "pow(t,2)/2", False),
+
+    # parenthesised operands lose one pair of parenthesis
+    ("(x+1)^2", "pow(x+1,2)", False),
+    ("x^(1/2)", "pow(x,1/2)", False),
+    ("((x))^2", "pow((x),2)", False),
+    ("x^((2))", "pow(x,(2))", False),
+    ("(2*(x+1))^(n-1)", "pow(2*(x+1),n-1)", False),
+    ("3.14*(r)^2 + 2^(n-1)", "3.14*pow(r,2) + pow(2,n-1)", False),
+    ("(x^2+1)^3", "pow(pow(x,2)+1,3)", False),
+
+    # several powers
+    ("x^2 + y^3", "pow(x,2) + pow(y,3)", False),
+    ("0.5*x^2 - 4*x^3 + x^4", "0.5*pow(x,2) - 4*pow(x,3) + pow(x,4)", False),
+    ("pow(x^2,3)", "pow(pow(x,2),3)", False),
+    ("(a)^(b)^(c)", "pow(a,pow(b,c))", True),
+    ("x^y^z", "pow(x,pow(y,z))", True),
+    ("pow(a,b)^2", "pow(pow(a,b),2)", True),
+
+    # redundant parenthesis around pow arguments
+    ("pow((2,x))", "pow(2,x)", False),
+    ("0.50*pow((2,x))", "0.50*pow(2,x)", False),
+    ("pow(((a, b)))", "pow(a, b)", False),
+    ("pow( (a,b) )", "pow(a,b)", False),
+    ("pow((x^2,3))", "pow(pow(x,2),3)", False),
+    ("pow(f(a,b),c)", "pow(f(a,b),c)", True),
+
+    # text join placeholders
+    ("(ARG{0})^2", "pow(ARG{0},2)", False),
+    ("ARG{1}*t^2/2", "ARG{1}*pow(t,2)/2", False),
+    ("(ARG{0}+1)^(ARG{2})", "pow(ARG{0}+1,ARG{2})", False),
+    ("ARG{0}^2", "pow(ARG{0},2)", True),
+    ("2^ARG{3}", "pow(2,ARG{3})", True),
+
+    # names and calls as operands
+    ("x2^3", "pow(x2,3)", True),
+    ("time^2", "pow(time,2)", True),
+    ("sin(x)^2", "pow(sin(x),2)", True),
+    ("2^xy", "pow(2,xy)", True),
+    ("x^-(1+2)", "pow(x,-(1+2))", True),
+    ("x^-y^2", "pow(x,-pow(y,2))", True),
+
+    # malformed expressions are left alone
+    ("x^", "x^", True),
+    ("(x+1", "(x+1", False),
+]
+
+# checks the rewriter against the corpus, and the legacy rewriter wherever it is expected to agree
+# returns the list of failures found
+def check_rewriter() -> list[str]:
+    failures : list[str] = []
+    for expression, expected, legacy_differs in rewriter_corpus:
+        result = update_pow_expressions(expression)
+        if result != expected:
+            failures.append("rewriter: " + repr(expression) + " -> " + repr(result) + ", expected " + repr(expected))
+
+        if legacy_differs: continue
+        try:
+            legacy_result = legacy_update_pow_expressions(expression)
+        except Exception as error:
+            legacy_result = "error: " + str(error)
+        if legacy_result != result:
+            failures.append("legacy: " + repr(expression) + " -> " + repr(legacy_result) + ", rewriter gave " +
+                            repr(result))
+
+    return failures
+
+if __name__ == '__main__':
+    corpus_failures = check_rewriter()
+    for failure in corpus_failures:
+        print(failure)
+    print(str(len(rewriter_corpus)) + " expressions checked, " + str(len(corpus_failures)) + " failures")
+    if len(corpus_failures) > 0: exit(1)
@@ -1,3 +1,6 @@
+import threading
+from time import time
+
 import selenium
 import selenium.webdriver
 from selenium.common import ElementClickInterceptedException, TimeoutException
@@ -13,6 +16,65 @@ from Utils import *
 
 global_timeout = 5  # sometimes pages need a long time to load or for a connection to re-stabilize
 
+# how long each kind of wait took over the run, to see where the time goes
+wait_latencies : dict[str, list[float]] = {}
+wait_latency_lock = threading.Lock()
+
+def record_wait(name : str, duration : float):
+    with wait_latency_lock:
+        wait_latencies.setdefault(name, []).append(duration)
+
+# waits until condition(driver) gives something truthy and returns it, recording how long that took under name
+def timed_wait(driver, name : str, condition, timeout=global_timeout):
+    start = time()
+    try:
+        return WebDriverWait(driver, timeout).until(condition)
+    finally:
+        record_wait(name, time() - start)
+
+def report_wait_latencies():
+    with wait_latency_lock:
+        for name, durations in sorted(wait_latencies.items()):
+            print("Waited on " + name + " " + str(len(durations)) + " times: " +
+                  "{:.3f}".format(sum(durations) / len(durations)) + "s average, " +
+                  "{:.3f}".format(max(durations)) + "s longest, " + "{:.2f}".format(sum(durations)) + "s total")
+
+# script which calls back after the next two animation frames, by which point pending layout and paint have happened
+settle_js : str = """
+var done = arguments[arguments.length - 1];
+requestAnimationFrame(function () { requestAnimationFrame(function () { done(true); }); });
+"""
+
+# script which calls back once arguments[0] has kept the same position and size over two animation frames (so any
+# animation moving it has finished), or with false after arguments[1] milliseconds
+stable_js : str = """
+var element = arguments[0];
+var timeout = arguments[1];
+var done = arguments[arguments.length - 1];
+var start = Date.now();
+var last = null;
+var check = function () {
+    var rect = element.getBoundingClientRect();
+    var curr = [rect.x, rect.y, rect.width, rect.height].join();
+    if (curr === last && rect.width > 0) done(true);
+    else if (Date.now() - start > timeout) done(false);
+    else { last = curr; requestAnimationFrame(check); }
+};
+requestAnimationFrame(check);
+"""
+
+# waits for the page to lay out and paint whatever was just changed
+def wait_for_settle(driver : WebDriver):
+    start = time()
+    driver.execute_async_script(settle_js)
+    record_wait("settle", time() - start)
+
+# waits for the element to stop moving, e.g. once a dialog has finished sliding in
+def wait_for_stable(driver : WebDriver, element : WebElement, timeout=global_timeout):
+    start = time()
+    driver.execute_async_script(stable_js, element, timeout * 1000)
+    record_wait("stable", time() - start)
+
 def print_element(driver : WebDriver, element : WebElement):
     # print("accessible name: " + element.accessible_name + ", tag: " + element.tag_name + ", text: " + element.text)
     print(driver.execute_script("return \"Outer: \\n\" + arguments[0].outerHTML + \"\\n Inner: \\n\" + arguments[0].innerHTML", element))
@@ -26,17 +88,34 @@ def ensure_in_view(driver, element : WebElement, timeout=global_timeout):
     ret = wait.until(EC.visibility_of(element))
     return ret
 
+# the close button of the prompts (jconfirm dialogs) the site shows, some of which only show up a while after the page
+prompt_close_xpath : str = "//div[@class='jconfirm-buttons']/button[text()='Close']"
+
+# closes every prompt which is showing, returning whether there were any
+def close_prompts(driver : WebDriver) -> bool:
+    closed = False
+    for close_button in driver.find_elements(By.XPATH, prompt_close_xpath):
+        if close_button.is_displayed():
+            close_button.click()
+            closed = True
+    return closed
+
+# how many times a click is tried while something else keeps intercepting it
+max_click_attempts : int = 5
+
 def goto_and_click(driver : WebDriver, target_id, by_val=By.XPATH, timeout=global_timeout):
-    intercepted = True
-    while intercepted:
+    for attempt in range(0, max_click_attempts):
         try:
             element = wait_and_get(driver, target_id, by_val, timeout)
             ensure_in_view(driver, element)
-            driver.implicitly_wait(0.25)  # wait for the element to become clickable
-            WebDriverWait(driver, global_timeout).until(EC.element_to_be_clickable(element)).click()
-            intercepted = False  # clearly the click succeeded, so we don't need to continue looping
+            timed_wait(driver, "clickable", EC.element_to_be_clickable(element)).click()
+            return  # clearly the click succeeded, so we don't need to continue looping
         except ElementClickInterceptedException as intercepted_click:
-            pass  # forcing JS to click for us does not actually work
+            # something which never moves fails the link, which is then retried from a fresh page
+            if attempt == max_click_attempts - 1: raise
+            # a prompt which showed up late is in the way, unless the click was meant for a dialog in the first place
+            if "jconfirm" not in str(target_id) and close_prompts(driver): print("A late prompt was found and ignored")
+            wait_for_settle(driver)  # forcing JS to click for us does not actually work, so let whatever covers it move
 
 
 def wait_for_vis(driver, target_id, by_val=By.CSS_SELECTOR, timeout=global_timeout):
@@ -99,15 +178,48 @@ def get_top_download(driver : WebDriver):
     curr_down = curr_down.find_element(value="frb0")
     return curr_down
 
-def init_bare_driver():
+# requests the fast profile drops: analytics, fonts, videos and every kind of image other than png and svg, since the
+# robot model images (and blockly's own icons) are pngs and svgs. Network.setBlockedURLs has no allow list, so images
+# are blocked by type rather than by exception
+blocked_url_patterns : list[str] = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*connect.facebook.net*", "*hotjar.com*",
+    "*fonts.googleapis.com*", "*fonts.gstatic.com*", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.ogv", "*.mov", "*youtube.com/embed*", "*player.vimeo.com*",
+    "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.bmp", "*.ico",
+]
+
+# the drivers of the fast profile. Network.setBlockedURLs only applies to the tab it was sent to, so it has to be sent
+# again for every tab they open
+request_blocking_drivers : set[WebDriver] = set()
+
+# blocks the requests in blocked_url_patterns in the current tab of the driver, if it is one of the fast profile
+def apply_request_blocking(driver : WebDriver):
+    if driver not in request_blocking_drivers: return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_url_patterns})
+
+# each profile keeps its own cookies, so separate profiles can stay logged in to separate accounts. With the "eager" or
+# "none" page load strategy, get returns before the whole page has loaded, so callers need their own readiness check.
+# The fast profile runs headless and blocks the requests in blocked_url_patterns; as nobody can log in to a headless
+# window, its profile needs to have been logged in to by a normal run first
+def init_bare_driver(profile_name : str = "testing0", page_load_strategy : str = "normal", fast : bool = False):
     options = selenium.webdriver.ChromeOptions()
+    options.page_load_strategy = page_load_strategy
+    if fast:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")  # headless windows are tiny otherwise, hiding parts of the page
     options.add_argument("--no-sandbox")  # apparently this is very insecure, but it should be okay
     options.add_argument("disable-infobars")
     options.add_argument("disable-features=DownloadBubble,DownloadBubbleV2")
-    options.add_argument(r"user-data-dir=" + str(append_cur_dir("cookies", "testing0")))
+    options.add_argument(r"user-data-dir=" + str(append_cur_dir("cookies", profile_name)))
     prefs = {"download.default_directory": append_cur_dir("Downloads"), "download.prompt_for_download" : False}
     options.add_experimental_option("prefs", prefs)
-    return selenium.webdriver.Chrome(options=options)  # program may get stuck here if it can't get enough resources
+    driver = selenium.webdriver.Chrome(options=options)  # program may get stuck here if it can't get enough resources
+
+    if fast: request_blocking_drivers.add(driver)
+    apply_request_blocking(driver)
+
+    return driver
 
 def initialize_driver(down_dir=append_cur_dir("Downloads")):
     # ensure files downloaded to correct location
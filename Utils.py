@@ -1,7 +1,10 @@
 import string
 import os
+import re
+import json
+import threading
+from collections import OrderedDict
 from lxml import etree
-from copy import deepcopy
 
 
 def prettyprint(element, **kwargs):
@@ -18,32 +21,43 @@ def insert_text_element(container, name, text):
     return text_element
 
 
+# prints whole containers before and after they are rewritten
+debug_printing : bool = False
+
+# the ADDn slot names of a text join, and the placeholders standing in for their non-text elements
+slot_name_pattern = re.compile(r"ADD(\d+)$")
+arg_placeholder_pattern = re.compile(r"ARG\{(\d+)\}")
+
 def update_expression_container(container : etree.Element) -> tuple[bool, str]:
     # text combination handling more complicated
     num_slots = int(container[0].attrib["items"])  # the slots available
-    filled_slots = 0
-    variables: dict[int, etree.Element] = {}  # the slots actually filled
-    result_text = ""  # the result of combining all variables and text
-    print("\nContainer start: \n")
-    prettyprint(container)
-
-    # elements in expression addition are 0 indexed
-    for i in range(0, num_slots):
-        potential_elements = container.xpath("./*[local-name()='value' and @name='ADD" + str(i) + "']")
-        if potential_elements is None or len(potential_elements) == 0: continue
-        curr_element = potential_elements[0]
-
-        filled_slots += 1
-
+    if debug_printing:
+        print("\nContainer start: \n")
+        prettyprint(container)
+
+    # elements in expression addition are 0 indexed; collect the filled slots in one pass over the children
+    slots : dict[int, etree.Element] = {}
+    for child in container:
+        if not isinstance(child.tag, str) or child.tag.rpartition('}')[2] != "value": continue
+        slot_name = slot_name_pattern.match(child.get("name", ""))
+        if slot_name is None: continue
+        slot_index = int(slot_name.group(1))
+        if slot_index < num_slots and slot_index not in slots: slots[slot_index] = child
+
+    variables: dict[int, etree.Element] = {}  # the slots which aren't text
+    result_pieces : list[str] = []  # the result of combining all variables and text
+    for slot_index in sorted(slots):
+        slot = slots[slot_index]
         # if this isn't text, we will just treat it as a variable to re-insert after
-        if curr_element[0] is None or curr_element[0].attrib["type"] != "text":
-            variables[i] = deepcopy(curr_element)
-            result_text += "ARG{" + str(i) + "}"  # we index based on the index assigned in xml
+        if len(slot) == 0 or slot[0].get("type") != "text" or len(slot[0]) == 0:
+            variables[slot_index] = slot
+            result_pieces.append("ARG{" + str(slot_index) + "}")  # we index based on the index assigned in xml
             continue
 
         # add the text from this element
-        result_text += curr_element[0][0].text
+        result_pieces.append(slot[0][0].text or "")
 
+    result_text = "".join(result_pieces)
     parsed_expressions : str = "    " + result_text
     print("Inspecting " + result_text + "\n")
 
@@ -53,70 +67,92 @@ def update_expression_container(container : etree.Element) -> tuple[bool, str]:
     if prev_text == result_text: return False, parsed_expressions  # no fixup needed
     parsed_expressions += " -> " + result_text  # indicate update for logging
 
-    # locate all arguments in the updated expression
-    variable_infos: list[list[int]] = []  # store the arg index and start and end char indices
-    arg_pos = result_text.find("ARG")
-    while arg_pos != -1:
-        arg_num_start = result_text.find("{", arg_pos + 3)
-        arg_num_end = result_text.find("}", arg_pos + 3)
-        variable_infos.append([int(result_text[arg_num_start + 1: arg_num_end]), arg_pos, arg_num_end])
-        arg_pos = result_text.find("ARG", arg_num_end + 1)
-
-    # split the result text
-    text_elements: list[str] = []
+    # split the updated expression into text and the variables placed between it, in order
+    segments : list[str | etree.Element] = []
     text_start = 0
-    for variable_info in variable_infos:
-        if text_start >= variable_info[1] - 1:
-            # these are two back to back variables or a variable at the start
-            text_start = variable_info[2] + 1
-            continue
-        text_elements.append(result_text[text_start: variable_info[1]])
-        text_start = variable_info[2] + 1  # after argument portion is over, text begins again
+    for placeholder in arg_placeholder_pattern.finditer(result_text):
+        variable = variables.pop(int(placeholder.group(1)), None)
+        if variable is None: continue  # not one of ours, so it stays part of the text
+        if placeholder.start() > text_start: segments.append(result_text[text_start : placeholder.start()])
+        segments.append(variable)
+        text_start = placeholder.end()
 
     # we need to grab the very last text
-    if text_start < len(result_text):
-        text_elements.append(result_text[text_start : len(result_text)])
-
-    # purge all elements other than the mutation
-    for i in range(1, filled_slots + 1):
-        # as we remove elements, subsequent ones have their index lowered
-        container.remove(container[1])
-
-    # set the exact number of elements needed
-    filled_slots = len(text_elements) + len(variable_infos)
-    container[0].set("items", str(filled_slots))
-
-    # insert all elements in order
-    element_count: int = 0
-    var_count : int = 0
-
-    # if we start with a variable instead of text, insert it first
-    if len(variable_infos) > 0 and variable_infos[0][1] == 0:
-        var = variables[variable_infos[var_count][0]]
-        var.set("name", "ADD" + str(element_count))
-        container.append(var)
-        var_count += 1
-        element_count += 1
-
-    for text_element in text_elements:
-        # first insert the text, then the variable that proceeds it
-        insert_text_element(container, "ADD" + str(element_count), text_element)
-
-        if element_count == filled_slots - 1: continue  # if we are one less than full, this was last element
-
-        # put the next element, since they are stored in L->R order in variable_infos
-        var = variables[variable_infos[var_count][0]]
-        var.set("name", "ADD" + str(element_count + 1))
-        container.append(var)
-
-        element_count += 2
-        var_count += 1
-
-    print("\nContainer end: \n")
-    prettyprint(container)
+    if text_start < len(result_text): segments.append(result_text[text_start : len(result_text)])
+
+    # take out all the slots, then put the variables back (moving the same elements) between new text elements
+    for slot in slots.values():
+        container.remove(slot)
+
+    container[0].set("items", str(len(segments)))  # set the exact number of elements needed
+    for element_count in range(0, len(segments)):
+        segment = segments[element_count]
+        if isinstance(segment, str):
+            insert_text_element(container, "ADD" + str(element_count), segment)
+        else:
+            segment.set("name", "ADD" + str(element_count))
+            container.append(segment)
+
+    if debug_printing:
+        print("\nContainer end: \n")
+        prettyprint(container)
     print("\nUpdated to " + result_text + "\n")
     return True, parsed_expressions
 
+# the values named $name inside blocks whose type contains $expression
+# because of the complications with namespaces with lxml and the fact that only one is ever used,
+# I am just using the * and local name to avoid the headache and poor documentation
+# apparently elements come out as [<Element {http://www.w3.org/1999/xhtml}block at 0x7fd7f814e440>]
+# apparently using .// isn't allowed
+expression_value_xpath = etree.XPath("//*[local-name()='block' and contains(@type, $expression)]"
+                                     "//*[local-name()='value' and @name=$name]")
+
+def is_draw_replace(expression : str) -> bool:
+    return expression == "draw_expr"
+
+# the name of the value holding the expression in the targeted blocks
+def get_target_input_name(target_expression : str) -> str:
+    if is_draw_replace(target_expression): return "VALUE_4"
+    return "expr"
+
+# updates the power expressions of every targeted expression in the activity xml, in place. Returns whether anything
+# was updated, the logging text of all parsed expressions, and the list of "old -> new" changes made
+def rewrite_activity_xml(activity_xml, target_expression : str, log=None) -> tuple[bool, str, list[str]]:
+    target_name = get_target_input_name(target_expression)
+    parsed_expressions : str = ""
+    changes : list[str] = []
+
+    expressions = expression_value_xpath(activity_xml, expression=target_expression, name=target_name)
+    did_update = False
+    for expression in expressions:
+        container = expression[0]
+        # pure text has simpler handling
+        if container.attrib["type"] == "text":
+            print("Inspecting " + container[0].text + "\n")
+            parsed_expressions += "    " + container[0].text
+            updated_text = update_pow_expressions(container[0].text)
+            if updated_text != container[0].text:
+                did_update = True
+                changes.append(container[0].text + " -> " + updated_text)
+                container[0].text = updated_text
+                print("Updated to " + updated_text + "\n")
+                parsed_expressions += " -> " + updated_text
+            parsed_expressions += "\n"
+            continue
+
+        # if the expression isn't pure text or a text combination we can't modify it
+        if container.attrib["type"] != "text_join":
+            if log is not None: log.write("\t Found non-text/text-join element matching expression!\n")
+            continue
+
+        container_result = update_expression_container(container)
+        expr_updated = container_result[0]
+        parsed_expressions += container_result[1] + "\n"
+        if expr_updated: changes.append(container_result[1].strip())
+        if not did_update: did_update = expr_updated
+
+    return did_update, parsed_expressions, changes
+
 # the current directory of this file
 def get_curr_dir():
     return os.path.dirname(os.path.realpath(__file__))
@@ -126,6 +162,19 @@ def get_curr_dir():
 def append_cur_dir(*suffix : str):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), *suffix)
 
+# the file name used when storing the xml of the link's activity (e.g. 12008_Example_2_Pre-Board.xml)
+def get_export_file_name(link : str, descriptor : str) -> str:
+    activity = link[link.rfind('/') + 1 : len(link)]
+    if activity.endswith(".php"): activity = activity[0 : len(activity) - 4]
+    slug = "".join(char if char.isalnum() or char == '-' else "_" for char in descriptor.strip())
+    return activity + "_" + "_".join(part for part in slug.split("_") if part != "") + ".xml"
+
+# gets the activity page a link points at, ignoring any query or fragment
+def get_activity_url(link : str) -> str:
+    for separator in ['#', '?']:
+        if link.find(separator) != -1: link = link[0 : link.find(separator)]
+    return link
+
 # returns the id of the indicated board
 def get_board_id(is_preboard : bool):
     if is_preboard: return "preBoard"
@@ -275,9 +324,10 @@ def update_pow_expr(expression : str, pow_index):
     # strip out the power,
     return expression[0 : base_bounds[0]] + operation + expression[power_bounds[1] + 1 : len(expression)]
 
-def update_pow_expressions(expression : str) -> str:
+# the original scan-and-rebuild rewriter, kept as the reference the rewriter corpus is checked against
+def legacy_update_pow_expressions(expression : str) -> str:
     # continue to perform replacement on all power expressions until they are replaced
-    expression = inspect_pow_expressions(expression)
+    expression = legacy_inspect_pow_expressions(expression)
 
     pow_index = expression.find('^')
     while pow_index > -1:
@@ -287,7 +337,7 @@ def update_pow_expressions(expression : str) -> str:
     return expression
 
 
-def inspect_pow_expressions(expression : str) -> str:
+def legacy_inspect_pow_expressions(expression : str) -> str:
     pow_index = expression.find("pow")
     while pow_index > -1:
         expression = inspect_pow_expr(expression, pow_index)
@@ -352,6 +402,269 @@ def inspect_pow_expr(expression : str, pow_index : int) -> str:
 
     return expression[0 : arg_start] + args_actual + expression[arg_end + 1 : len(expression)]
 
+# splits an expression into ARG{n} placeholders, numbers, names, single structural characters (parenthesis, commas
+# and ^) and runs of everything else, such as operators and whitespace
+pow_token_pattern = re.compile(r"ARG\{\d+\}|[0-9.]+|[^\W\d]\w*|[(),^]|[^\w(),^.]+")
+# the text up to the next parenthesis, comma or ^ the rewriter has to stop at, then that character (or nothing at the end
+# of the expression). A group holding none of those and not raised to a power has nothing to rewrite, so it is taken
+# as part of the text
+pow_text_pattern = re.compile(r"((?:[^(),^]+|\([^(),^]*\)(?!\s*\^))*)([(),^]?)")
+
+# a ^ right after an operand (give or take whitespace), the run of signs after it, and the start of the power's operand:
+# either an opening parenthesis, or a number, name or ARG{n} placeholder
+pow_power_pattern = re.compile(r"\s*\^([^\w(),^.]*)(?:(\()|(ARG\{\d+\}|[0-9.]+|[^\W\d]\w*))")
+
+# the last token of some text (see pow_token_pattern), if the text ends with one
+def get_last_token(text : str) -> str | None:
+    if text == "": return None
+    last = pow_token_pattern.findall(text)[-1]
+    return last if text.endswith(last) else None
+
+# the whole expression, a parenthesised group or the arguments of a call, while the rewriter is inside it
+class PowSequence:
+    def __init__(self, start : int, closing : bool, name : str | None = None):
+        self.start : int = start  # the first output slot of its contents
+        self.closing : bool = closing  # whether it ends at a closing parenthesis, rather than the end of the expression
+        self.name : str | None = name  # the function called, for call arguments
+        self.items : int = 0  # everything but whitespace, where a run of text only copied over counts once
+        self.first_group_args : tuple[int, int] | None = None
+        self.has_comma : bool = False
+        self.powers : int = 0  # the pows opened for the operand being raised, left to close once its last power is parsed
+        self.sign : str | None = None  # the sign of the power being parsed, None if it is not a power
+
+    # the output slots of its contents if it is a comma separated argument list (possibly wrapped in redundant
+    # parenthesis) once the wrapping is dropped
+    def get_group_args(self, end : int) -> tuple[int, int] | None:
+        if self.has_comma: return self.start, end
+        if self.items == 1: return self.first_group_args
+        return None
+
+# rewrites x^y as pow(x,y) and unwraps redundant parenthesis in pow((x,y)) in one left to right pass.
+# Operands are numbers, names, calls such as sin(x), ARG{n} placeholders and parenthesised groups, the last of which
+# lose their outer parenthesis inside pow. A power can be signed (x^-2) and is right associative (x^y^z).
+# The pass jumps from one parenthesis, comma or ^ to the next, copying the text between them over unless it ends in the
+# operand of a power or the name of a call. Groups are kept on an explicit stack rather than recursed into, so nesting
+# depth is only limited by memory. The output is a list of slots joined once at the end: an operand turning out to be
+# raised to a power gets pow( put in its first slot, and parenthesis which are dropped have their slots emptied
+class PowRewriter:
+    def __init__(self, expression : str, rewrite_carets : bool = True):
+        self.expression : str = expression
+        self.rewrite_carets : bool = rewrite_carets
+        self.output : list[str] = []
+        self.stack : list[PowSequence] = []
+
+    def rewrite(self) -> str:
+        expression = self.expression
+        output = self.output = []
+        stack = self.stack = [PowSequence(0, False)]
+        index = 0
+        while True:
+            sequence = stack[len(stack) - 1]
+            match = pow_text_pattern.match(expression, index)
+            text, char = match.groups()
+            end = match.end(1)
+
+            if char == '^' and self.rewrite_carets:
+                stripped = text.rstrip()
+                base = get_last_token(stripped)
+                if base is not None and (base[0].isalnum() or base[0] == '_' or base[0] == '.'):
+                    # the operand being raised. Without a power after the ^, it is added as it is and the ^ is found
+                    # again, this time without an operand before it
+                    base_end = index + len(stripped)
+                    self.add_text(sequence, expression[index : base_end - len(base)])
+                    output.append(base)
+                    index = self.add_operand(sequence, len(output) - 1, False, None, base_end)
+                    continue
+
+            if char == '(':
+                # a call, whose arguments are parsed like any other group. Numbers and ARG{n} placeholders (the
+                # non-text elements of a text join) can't be called
+                name = get_last_token(text) if text != "" and (text[-1].isalnum() or text[-1] == '_') else None
+                if name is not None and not name[0].isdigit() and name[0] != '.':
+                    self.add_text(sequence, text[0 : len(text) - len(name)])
+                    output.append(name + "(")
+                    stack.append(PowSequence(len(output), True, name))
+                else:
+                    self.add_text(sequence, text)
+                    output.append("(")
+                    stack.append(PowSequence(len(output), True))
+                index = end + 1
+                continue
+
+            self.add_text(sequence, text)
+            if char == ',' or char == '^' or (char == ')' and not sequence.closing):
+                if char == ',': sequence.has_comma = True
+                self.add_text(sequence, char)
+                index = end + 1
+                continue
+
+            # the end of the expression, or the closing parenthesis of the group
+            stack.pop()
+            if len(stack) == 0: return "".join(output)
+
+            closed = char == ')'
+            index = end + 1 if closed else end
+            group_args = sequence.get_group_args(len(output))
+            if closed: output.append(")")
+            if sequence.name is None:
+                if not closed: group_args = None  # never closed, so it is left as it is
+                index = self.add_operand(stack[len(stack) - 1], sequence.start - 1, closed, group_args, index)
+                continue
+
+            if sequence.name == "pow" and group_args is not None:
+                # pow((x,y)) -> pow(x,y)
+                for i in range(sequence.start, group_args[0]): output[i] = ""
+                for i in range(group_args[1], len(output) - 1 if closed else len(output)): output[i] = ""
+            index = self.add_operand(stack[len(stack) - 1], sequence.start - 1, False, None, index)
+
+    # copies text over which holds nothing to rewrite
+    def add_text(self, sequence : PowSequence, text : str):
+        if text == "": return
+        self.output.append(text)
+        if not text.isspace(): sequence.items += 1
+
+    # takes an operand of the sequence which ended at index, and starts at output slot start. Groups have their
+    # parenthesis in the first and last slots and, if they wrap an argument list, the slots of its contents as
+    # group_args. Any powers following the operand are parsed too, up to the first one which is a group or a call, which
+    # is left on the stack to be parsed next. Returns where parsing carries on from
+    def add_operand(self, sequence : PowSequence, start : int, is_group : bool, group_args : tuple[int, int] | None,
+                    index : int) -> int:
+        expression = self.expression
+        output = self.output
+        while self.rewrite_carets and index < len(expression):
+            if expression[index] != '^' and not expression[index].isspace(): break  # most operands are not raised
+            match = pow_power_pattern.match(expression, index)
+            if match is None: break  # nothing to raise to
+            sign = match.group(1).strip()
+            if sign.strip("+-") != "": break
+
+            # the operand is raised, so it becomes the first argument of a pow, without its outer parenthesis
+            if is_group:
+                output[start] = "pow("
+                output[len(output) - 1] = ""
+            else:
+                output[start] = "pow(" + output[start]
+            output.append(",")
+            sequence.powers += 1
+
+            sequence.sign = sign
+            if sign != "": output.append(sign)
+            index = match.end()
+            if match.group(2) is not None:
+                output.append("(")
+                self.stack.append(PowSequence(len(output), True))
+                return index
+
+            token = match.group(3)
+            if (index < len(expression) and expression[index] == '(' and not token[0].isdigit() and token[0] != '.' and
+                    token[len(token) - 1] != '}'):
+                output.append(token + "(")
+                self.stack.append(PowSequence(len(output), True, token))
+                return index + 1
+
+            output.append(token)
+            start = len(output) - 1
+            is_group = False
+
+        if sequence.sign is not None:
+            # the last power of the operand being raised, which loses its outer parenthesis unless it is signed
+            if is_group and sequence.sign == "":
+                output[start] = ""
+                output[len(output) - 1] = ""
+            output.append(")" * sequence.powers)
+            sequence.powers = 0
+            sequence.sign = None
+            group_args = None
+
+        sequence.items += 1
+        if sequence.items == 1: sequence.first_group_args = group_args
+        return index
+
+# bump whenever rewrite_pow_expressions can give a different result, so rewrites saved by older versions are ignored
+rewriter_version : int = 3
+
+# bounded least recently used cache of expression rewrites in front of the rewriter. With a location, it also starts
+# from the rewrites saved there (by the same rewriter version) and can save its own back
+class RewriteCache:
+    def __init__(self, max_size : int = 4096, max_saved : int = 16384):
+        self.max_size : int = max_size  # 0 turns caching off
+        self.max_saved : int = max_saved  # how many rewrites the file keeps, dropping the least recently used
+        self.entries : OrderedDict[str, str] = OrderedDict()
+        self.saved : dict[str, str] = {}  # the on-disk tier, looked in when an expression isn't in entries
+        self.location : str | None = None
+        self.hits : int = 0
+        self.saved_hits : int = 0
+        self.misses : int = 0
+        self.lock = threading.Lock()
+
+    # loads the rewrites saved at location, unless they came from a different rewriter version
+    def open(self, location : str):
+        self.location = location
+        if not os.path.exists(location): return
+        with open(location, 'r') as saved:
+            contents = json.load(saved)
+        if contents.get("version") == rewriter_version: self.saved = contents["rewrites"]
+
+    def get_rewrite(self, expression : str, rewrite) -> str:
+        if self.max_size <= 0: return rewrite(expression)
+
+        with self.lock:
+            result = self.entries.get(expression)
+            if result is not None:
+                self.entries.move_to_end(expression)
+                self.hits += 1
+                return result
+
+            result = self.saved.get(expression)
+            if result is not None: self.saved_hits += 1
+
+        if result is None:
+            result = rewrite(expression)
+            with self.lock: self.misses += 1
+
+        with self.lock:
+            self.entries[expression] = result
+            if len(self.entries) > self.max_size: self.entries.popitem(last=False)
+        return result
+
+    # writes the most recently used rewrites into the file it was opened from, replacing it as a whole. The file is
+    # kept in order of use, so the ones used this run go last and the oldest are the ones dropped past max_saved
+    def save(self):
+        if self.location is None: return
+        with self.lock:
+            rewrites = dict(self.saved)
+            for expression, result in self.entries.items():
+                rewrites.pop(expression, None)
+                rewrites[expression] = result
+        for expression in list(rewrites)[0 : max(0, len(rewrites) - self.max_saved)]: rewrites.pop(expression)
+        temp_location = self.location + ".tmp"
+        with open(temp_location, 'w') as saved:
+            json.dump({"version": rewriter_version, "rewrites": rewrites}, saved)
+        os.replace(temp_location, self.location)
+        self.saved = rewrites
+
+    def report(self):
+        lookups = self.hits + self.saved_hits + self.misses
+        if lookups == 0: return
+        print("Expression rewrites: " + str(lookups) + " lookups, " + str(self.hits) + " cached, " +
+              str(self.saved_hits) + " from disk, " + str(self.misses) + " computed (" +
+              "{:.1f}".format(100 * (self.hits + self.saved_hits) / lookups) + "% hit rate)")
+
+# the cache every update_pow_expressions call goes through
+rewrite_cache : RewriteCache = RewriteCache()
+
+def update_pow_expressions(expression : str) -> str:
+    if expression.find('^') == -1 and expression.find("pow") == -1: return expression  # nothing to rewrite
+    return rewrite_cache.get_rewrite(expression, rewrite_pow_expressions)
+
+# update_pow_expressions without the cache
+def rewrite_pow_expressions(expression : str) -> str:
+    return PowRewriter(expression).rewrite()
+
+def inspect_pow_expressions(expression : str) -> str:
+    if expression.find("pow") == -1: return expression
+    return PowRewriter(expression, rewrite_carets=False).rewrite()
+
 def parse_out_links(location, separator):
     links: list[str] = []
 
@@ -0,0 +1,107 @@
+import threading
+import traceback
+from time import time
+
+from Utils import *
+
+# shared view of a run over many links, safe to update from several worker threads
+class RunProgress:
+    def __init__(self, total : int, log_location : str):
+        self.total : int = total
+        self.completed : int = 0
+        self.started : int = 0
+        self.dropped : int = 0  # links left unprocessed by a worker which stopped
+        self.finished : set[tuple[str, str]] = set()  # the (link, descriptor) of every completed link
+        self.start_time : float = time()
+        self.log_location : str = log_location
+        self.lock = threading.Lock()
+
+    # announces a link being picked up by a worker
+    def start_link(self, worker_name : str, link : str, info : list[str]):
+        with self.lock:
+            self.started += 1
+            print(worker_name + "On link " + str(self.started) + "/" + str(self.total) + " with info: " + str(info))
+
+    # records the outcome of a link in the shared progress view and the merged result log
+    def finish_link(self, worker_name : str, link : str, info : list[str], outcome : str, duration : float):
+        with self.lock:
+            self.completed += 1
+            self.finished.add((link, info[0]))
+            elapsed = time() - self.start_time
+            rate = self.completed / elapsed if elapsed > 0 else 0
+            print(worker_name + "Completed " + str(self.completed) + "/" + str(self.total) + " (" +
+                  "{:.2f}".format(rate * 60) + " links/min): " + link)
+
+            with open(self.log_location, 'a') as log:
+                log.write(worker_name.strip() + "\t" + link + "\t" + info[0] + "\t" + outcome + "\t" +
+                          "{:.2f}".format(duration) + "\n")
+
+    # whether the link has been completed, whatever its outcome
+    def is_finished(self, link : str, descriptor : str) -> bool:
+        with self.lock:
+            return (link, descriptor) in self.finished
+
+    # records links a worker stopped before completing
+    def drop_links(self, worker_name : str, count : int):
+        with self.lock:
+            self.dropped += count
+            print(worker_name + "Dropped " + str(count) + " links which were never completed")
+
+    # the final tally of the run
+    def report(self):
+        with self.lock:
+            summary = "Completed " + str(self.completed) + "/" + str(self.total) + " links"
+            if self.dropped > 0:
+                summary += "; " + str(self.dropped) + " were dropped when their worker stopped (see the dead letters)"
+            print(summary)
+
+# reorders the links so every entry of one activity directly follows the first entry of it, letting one page visit
+# handle all of them. Activities keep the order they first appear in, with the start blocks before any example,
+# solution or board of the same activity
+def group_links_by_activity(links : list[str], info : list[list[str]]) -> tuple[list[str], list[list[str]]]:
+    groups : dict[str, list[int]] = {}
+    for i in range(0, len(links)):
+        groups.setdefault(get_activity_url(links[i]), []).append(i)
+
+    order : list[int] = []
+    for indices in groups.values():
+        indices.sort(key=lambda index: LinkInfo(info[index][0]).has_num())  # stable, so otherwise keeps the order
+        order.extend(indices)
+
+    return [links[i] for i in order], [info[i] for i in order]
+
+# splits the links into at most shard_count shards, keeping every entry of one activity in the same shard so
+# two browsers never edit the same activity at once. Order within a shard follows the original order
+def shard_links(links : list[str], info : list[list[str]], shard_count : int) -> list[tuple[list[str], list[list[str]]]]:
+    shards : list[tuple[list[str], list[list[str]]]] = [([], []) for _ in range(0, shard_count)]
+    activity_shards : dict[str, int] = {}
+    for i in range(0, len(links)):
+        activity = get_activity_url(links[i])
+        if activity not in activity_shards:
+            activity_shards[activity] = len(activity_shards) % shard_count  # round-robin over activities
+
+        shard = shards[activity_shards[activity]]
+        shard[0].append(links[i])
+        shard[1].append(info[i])
+
+    return [shard for shard in shards if len(shard[0]) > 0]
+
+# runs worker(worker_index, shard) for every shard on its own thread, returning once all are finished. If a worker
+# stops with an error, on_error(worker_index, shard, error) gets to account for what it left of its shard
+def run_worker_pool(shards : list, worker, on_error=None):
+    def run_worker(worker_index, shard):
+        try:
+            worker(worker_index, shard)
+        except Exception as error:
+            print("[worker " + str(worker_index) + "] Worker stopped with error: \n", error,
+                  "\n and traceback: \n", traceback.format_exc())
+            if on_error is not None: on_error(worker_index, shard, error)
+
+    threads : list[threading.Thread] = []
+    for i in range(0, len(shards)):
+        thread = threading.Thread(target=run_worker, args=(i, shards[i]), name="worker" + str(i))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,53 @@
+import io
+import tarfile
+
+import pytest
+
+from BatchTransformer import *
+
+activity_xml : bytes = (b'<xml xmlns="https://developers.google.com/blockly/xml">'
+                        b'<block type="draw_expr" id="b0"><value name="VALUE_4">'
+                        b'<block type="text"><field name="TEXT">x^2</field></block>'
+                        b'</value></block></xml>')
+
+def make_tarball(location, names : list[str]):
+    with tarfile.open(location, 'w') as archive:
+        for name in names:
+            member = tarfile.TarInfo(name)
+            member.size = len(activity_xml)
+            archive.addfile(member, io.BytesIO(activity_xml))
+
+def test_rewrites_into_out_dir(tmp_path):
+    out_dir = tmp_path / "out"
+    entry = transform_activity_file(("lesson/a.xml", activity_xml, "draw_expr", str(out_dir)))
+    assert entry["status"] == "updated"
+    assert b"pow(x,2)" in (out_dir / "lesson" / "a.xml").read_bytes()
+
+@pytest.mark.parametrize("name", ["../evil.xml", "lesson/../../evil.xml", "/tmp/evil.xml", "."])
+def test_rejects_names_outside_out_dir(tmp_path, name):
+    out_dir = tmp_path / "out"
+    entry = transform_activity_file((name, activity_xml, "draw_expr", str(out_dir)))
+    assert entry["status"] == "error"
+    assert "outside" in entry["error"]
+    assert not (tmp_path / "evil.xml").exists()
+
+def test_rejects_symlinked_directories(tmp_path):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    (out_dir / "link").symlink_to(tmp_path)
+    entry = transform_activity_file(("link/evil.xml", activity_xml, "draw_expr", str(out_dir)))
+    assert entry["status"] == "error"
+    assert not (tmp_path / "evil.xml").exists()
+
+def test_tarball_with_traversal(tmp_path):
+    source = tmp_path / "activities.tar"
+    make_tarball(source, ["good/a.xml", "../evil.xml", "/tmp/absolute_evil.xml"])
+    out_dir = tmp_path / "out"
+
+    entries = {entry["file"]: entry for entry in transform_activities(str(source), str(out_dir), "draw_expr", 1)}
+    assert entries["good/a.xml"]["status"] == "updated"
+    assert entries["../evil.xml"]["status"] == "error"
+    assert entries["/tmp/absolute_evil.xml"]["status"] == "error"
+    assert (out_dir / "good" / "a.xml").exists()
+    assert not (tmp_path / "evil.xml").exists()
+    assert not os.path.exists("/tmp/absolute_evil.xml")
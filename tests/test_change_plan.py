@@ -0,0 +1,26 @@
+from ChangePlan import *
+
+def test_add_and_resolve(tmp_path):
+    location = str(tmp_path / "change_plan.jsonl")
+    plan = ChangePlan(location)
+    plan.add("update_models", "Linkbot", "a/1.php", "Lesson", {"robots": [1]})
+    plan.add("update_models", "Linkbot", "b/2.php", "Lesson Example 1", {"robots": [2]})
+    plan.add("replace_pow_xml", "draw_expr", "a/1.php", "Lesson", {"expressions": ["x^2 -> pow(x,2)"]})
+
+    plan = ChangePlan(location)
+    assert plan.get_links("update_models", "Linkbot") == [("a/1.php", "Lesson"), ("b/2.php", "Lesson Example 1")]
+
+    plan.resolve("update_models", "Linkbot", "a/1.php", "Lesson")
+    plan.resolve("update_models", "Linkbot", "c/3.php", "Lesson")  # never planned
+    assert ChangePlan(location).get_links("update_models", "Linkbot") == [("b/2.php", "Lesson Example 1")]
+
+def test_clear_only_drops_that_action_and_info(tmp_path):
+    location = str(tmp_path / "change_plan.jsonl")
+    plan = ChangePlan(location)
+    plan.add("update_models", "Linkbot", "a/1.php", "Lesson", {})
+    plan.add("replace_pow_xml", "draw_expr", "a/1.php", "Lesson", {})
+    plan.clear("update_models", "Linkbot")
+
+    plan = ChangePlan(location)
+    assert plan.get_links("update_models", "Linkbot") == []
+    assert plan.get_links("replace_pow_xml", "draw_expr") == [("a/1.php", "Lesson")]
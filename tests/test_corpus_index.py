@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+
+from CorpusIndex import *
+
+# the expression value sits under a statement block nested in the targeted block, not directly on it
+nested_xml : bytes = (b'<xml xmlns="https://developers.google.com/blockly/xml">'
+                      b'<block type="draw_expr_group" id="b0"><statement name="DO">'
+                      b'<block type="controls_repeat" id="b1"><value name="VALUE_4">'
+                      b'<block type="text" id="b2"><field name="TEXT">x^2</field></block>'
+                      b'</value></block></statement></block></xml>')
+
+@pytest.fixture
+def index(tmp_path):
+    return CorpusIndex(str(tmp_path / "corpus.db"))
+
+def test_containers_include_every_enclosing_block():
+    root = etree.fromstring(nested_xml)
+    field = next(element for element in root.iter() if etree.QName(element).localname == "field")
+    assert get_value_containers(field) == [("controls_repeat", "VALUE_4"), ("draw_expr_group", "VALUE_4")]
+
+def test_candidates_match_what_the_rewriter_changes(index):
+    index.add("nested.xml", nested_xml)
+    assert rewrite_activity_xml(etree.fromstring(nested_xml), "draw_expr")[0]
+    assert find_pow_candidates(index, "draw_expr") == {"nested.xml"}
+    assert find_pow_candidates(index, "robot_expr") == set()
+
+def test_unchanged_document_is_not_reindexed(index):
+    assert index.add("nested.xml", nested_xml)
+    assert not index.add("nested.xml", nested_xml)
+
+def test_index_from_an_older_version_is_emptied(tmp_path):
+    location = str(tmp_path / "corpus.db")
+    CorpusIndex(location).add("nested.xml", nested_xml)
+    connection = sqlite3.connect(location)
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+    connection.close()
+    assert CorpusIndex(location).get_files() == set()
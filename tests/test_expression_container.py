@@ -0,0 +1,51 @@
+from Utils import *
+
+# a text_join block with one ADDn slot per piece, where str pieces are text blocks and anything else is a variable name
+def make_container(pieces : list) -> etree.Element:
+    container = etree.Element("block", {"type": "text_join"})
+    etree.SubElement(container, "mutation", {"items": str(len(pieces))})
+    for i in range(0, len(pieces)):
+        if isinstance(pieces[i], str):
+            insert_text_element(container, "ADD" + str(i), pieces[i])
+        else:
+            slot = etree.SubElement(container, "value", {"name": "ADD" + str(i)})
+            variable = etree.SubElement(slot, "block", {"type": "variables_get"})
+            etree.SubElement(variable, "field", {"name": "VAR"}).text = pieces[i][0]
+    return container
+
+# the pieces of the container, in the same form make_container takes them
+def get_pieces(container : etree.Element) -> list:
+    pieces : list = []
+    for slot in container.findall("value"):
+        assert slot.get("name") == "ADD" + str(len(pieces))
+        if slot[0].get("type") == "text": pieces.append(slot[0][0].text)
+        else: pieces.append((slot[0][0].text,))
+    assert container[0].get("items") == str(len(pieces))
+    return pieces
+
+def test_interleaved_text_and_variables():
+    container = make_container(["x^", ("n",), " + ", ("y",), "^2"])
+    assert update_expression_container(container)[0]
+    assert get_pieces(container) == ["pow(x,", ("n",), ") + pow(", ("y",), ",2)"]
+
+def test_adjacent_variables_are_kept():
+    container = make_container(["2^", ("a",), ("b",), " + 1"])
+    assert update_expression_container(container)[0]
+    assert get_pieces(container) == ["pow(2,", ("a",), ")", ("b",), " + 1"]
+
+def test_variable_as_base():
+    container = make_container([("x",), "^3"])
+    assert update_expression_container(container)[0]
+    assert get_pieces(container) == ["pow(", ("x",), ",3)"]
+
+def test_nothing_to_rewrite_is_left_alone():
+    container = make_container(["x + ", ("n",)])
+    before = etree.tostring(container)
+    assert not update_expression_container(container)[0]
+    assert etree.tostring(container) == before
+
+def test_empty_container():
+    container = make_container([])
+    before = etree.tostring(container)
+    assert update_expression_container(container) == (False, "    ")
+    assert etree.tostring(container) == before
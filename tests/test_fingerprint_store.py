@@ -0,0 +1,17 @@
+from FingerprintStore import *
+
+def test_verify_and_forget(tmp_path):
+    location = str(tmp_path / "fingerprints.json")
+    store = FingerprintStore(location)
+    fingerprint = get_fingerprint("Linkbot\nLinkbot")
+    assert not store.is_verified("update_models", "Linkbot-I", "a/1.php", "Lesson", fingerprint)
+
+    store.verify("update_models", "Linkbot-I", "a/1.php", "Lesson", fingerprint)
+    store = FingerprintStore(location)
+    assert store.is_verified("update_models", "Linkbot-I", "a/1.php", "Lesson", fingerprint)
+    assert not store.is_verified("update_models", "Linkbot-I", "a/1.php", "Lesson", get_fingerprint("Linkbot"))
+    assert not store.is_verified("update_models", "Linkbot-I", "a/1.php", "Lesson Example 1", fingerprint)
+    assert not store.is_verified("update_models", "Mindstorms", "a/1.php", "Lesson", fingerprint)
+
+    store.forget("update_models", "Linkbot-I", "a/1.php", "Lesson")
+    assert not FingerprintStore(location).is_verified("update_models", "Linkbot-I", "a/1.php", "Lesson", fingerprint)
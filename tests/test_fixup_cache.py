@@ -0,0 +1,32 @@
+from FixupCache import *
+
+def test_outcome_is_kept_per_activity(tmp_path):
+    cache = FixupCache(str(tmp_path / "fixup_cache.json"), str(tmp_path / "PotentialOverwrites.txt"))
+    cache.add("https://example.com/a.php", fixup_applied, "Activity A")
+
+    cache = FixupCache(str(tmp_path / "fixup_cache.json"), str(tmp_path / "PotentialOverwrites.txt"))
+    assert cache.get("https://example.com/a.php#example2")["status"] == fixup_applied
+    assert cache.get("https://example.com/b.php") is None
+
+def test_recheck_ignores_the_cache(tmp_path):
+    cache = FixupCache(str(tmp_path / "fixup_cache.json"), str(tmp_path / "PotentialOverwrites.txt"))
+    cache.add("https://example.com/a.php", fixup_no_fix, "Activity A")
+
+    cache = FixupCache(str(tmp_path / "fixup_cache.json"), str(tmp_path / "PotentialOverwrites.txt"), recheck=True)
+    assert cache.get("https://example.com/a.php") is None
+    cache.add("https://example.com/a.php", fixup_applied, "Activity A")  # the recheck replaces the old outcome
+    assert FixupCache(str(tmp_path / "fixup_cache.json"))\
+               .get("https://example.com/a.php")["status"] == fixup_applied
+
+def test_report_is_written_and_read_back(tmp_path):
+    report = tmp_path / "PotentialOverwrites.txt"
+    cache = FixupCache(str(tmp_path / "fixup_cache.json"), str(report))
+    cache.add("https://example.com/a.php", fixup_no_source, "Activity A")
+    cache.add("https://example.com/b.php", fixup_model_count_mismatch, "Activity B")
+    assert report.read_text() == "NO SOURCE: https://example.com/a.php\n" \
+                                 "MODEL COUNT MISMATCH: https://example.com/b.php - Activity B\n"
+
+    # a report from before the cache existed is carried over
+    cache = FixupCache(str(tmp_path / "missing.json"), str(report))
+    assert cache.get("https://example.com/b.php") == {"link": "https://example.com/b.php",
+                                                      "status": fixup_model_count_mismatch, "title": "Activity B"}
@@ -0,0 +1,38 @@
+import pytest
+
+from AutoActivityUpdater import get_link_filters
+from LinkStore import *
+
+source : str = "https://example.com/links.php"
+
+descriptors : list[str] = ["Lesson", "Lesson Pre-Board", "Lesson Example 1", "Lesson Solution #2 Post-Board",
+                           "Activity", "Activity Example 2 Pre-Board", "Activity Solution 1"]
+
+@pytest.fixture
+def store(tmp_path):
+    store = LinkStore(str(tmp_path / "links.db"))
+    store.refresh(source, [("https://example.com/" + str(i) + ".php", descriptors[i]) for i in range(0, len(descriptors))])
+    return store
+
+def get_descriptors(store : LinkStore, filter_names : list[str] | None, num : int | None = None) -> list[str]:
+    return [info[0] for info in store.query(source, **get_link_filters(filter_names, num))[1]]
+
+@pytest.mark.parametrize("filter_names, expected", [
+    (None, descriptors),
+    (["lesson"], ["Lesson", "Lesson Pre-Board", "Lesson Example 1", "Lesson Solution #2 Post-Board"]),
+    (["activity"], ["Activity", "Activity Example 2 Pre-Board", "Activity Solution 1"]),
+    (["pre"], ["Lesson Pre-Board", "Activity Example 2 Pre-Board"]),
+    (["post"], ["Lesson Solution #2 Post-Board"]),
+    (["no-board"], ["Lesson", "Lesson Example 1", "Activity", "Activity Solution 1"]),
+    (["example"], ["Lesson Example 1", "Activity Example 2 Pre-Board"]),
+    (["solution"], ["Lesson Solution #2 Post-Board", "Activity Solution 1"]),
+    (["start"], ["Lesson", "Lesson Pre-Board", "Activity"]),
+    (["lesson", "pre"], ["Lesson Pre-Board"]),
+    (["activity", "solution"], ["Activity Solution 1"]),
+])
+def test_filter(store, filter_names, expected):
+    assert get_descriptors(store, filter_names) == expected
+
+def test_num(store):
+    assert get_descriptors(store, None, 2) == ["Lesson Solution #2 Post-Board", "Activity Example 2 Pre-Board"]
+    assert get_descriptors(store, ["solution"], 1) == ["Activity Solution 1"]
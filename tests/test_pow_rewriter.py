@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from Utils import *
+from RewriterCorpus import rewriter_corpus
+
+@pytest.mark.parametrize("expression, expected, legacy_differs", rewriter_corpus)
+def test_corpus(expression, expected, legacy_differs):
+    assert rewrite_pow_expressions(expression) == expected
+
+@pytest.mark.parametrize("expression, expected", [
+    ("x^y^z", "pow(x,pow(y,z))"),
+    ("x^x^x", "pow(x,pow(x,x))"),
+    ("2^3^4^5", "pow(2,pow(3,pow(4,5)))"),
+    ("(x^y)^z", "pow(pow(x,y),z)"),
+    ("x ^ y ^ z + 1", "pow(x,pow(y,z)) + 1"),
+])
+def test_right_associative(expression, expected):
+    assert rewrite_pow_expressions(expression) == expected
+
+@pytest.mark.parametrize("expression, expected", [
+    ("-x^2", "-pow(x,2)"),
+    ("x^-2", "pow(x,-2)"),
+    ("x^ - 2", "pow(x,-2)"),
+    ("x^-(y+1)", "pow(x,-(y+1))"),
+    ("x^-y^2", "pow(x,-pow(y,2))"),
+    ("x^+2", "pow(x,+2)"),
+])
+def test_unary_minus(expression, expected):
+    assert rewrite_pow_expressions(expression) == expected
+
+@pytest.mark.parametrize("expression, expected", [
+    ("(x+1)^2", "pow(x+1,2)"),
+    ("((x))^2", "pow((x),2)"),
+    ("x^(1/2)", "pow(x,1/2)"),
+    ("(a+b)^(c-d)", "pow(a+b,c-d)"),
+    ("sin(x)^2", "pow(sin(x),2)"),
+    ("pow((x,2))", "pow(x,2)"),
+    ("pow( ((x,2)) )", "pow(x,2)"),
+    ("pow((x),2)", "pow((x),2)"),
+    ("f((x+1))", "f((x+1))"),
+])
+def test_parenthesis(expression, expected):
+    assert rewrite_pow_expressions(expression) == expected
+
+@pytest.mark.parametrize("depth", [1, 10, 1000, 5000])
+def test_nesting_depth(depth):
+    # ((x^2)^2)^2 and so on, past anything a recursive parser could go through
+    expression = "(" * depth + "x" + ")^2" * depth
+    expected = "pow(" * (depth + 1) + "x" + ",2)" * (depth + 1)
+    assert rewrite_pow_expressions("(" + expression + ")^2") == expected
+
+    calls = "f(" * depth + "x^2" + ")" * depth
+    assert rewrite_pow_expressions(calls) == "f(" * depth + "pow(x,2)" + ")" * depth
+
+    chain = "x" + "^x" * depth
+    assert rewrite_pow_expressions(chain) == "pow(x," * depth + "x" + ")" * depth
+
+def test_nesting_is_linear():
+    start = time.perf_counter()
+    rewrite_pow_expressions("(" * 20000 + "x" + ")^2" * 20000)
+    assert time.perf_counter() - start < 2
+
+@pytest.mark.parametrize("expression", [
+    "x^",
+    "x^ ",
+    "^2",
+    "x^*2",
+    "x^)",
+    "x^,",
+    "x^^2",
+    "(x",
+    "(x+1",
+    "x)^2",
+    "f(x",
+    "pow((x,2)",
+    "((((",
+    "))))",
+])
+def test_malformed(expression):
+    # whatever can't be read as a power is left as it is, without raising
+    rewritten = rewrite_pow_expressions(expression)
+    assert isinstance(rewritten, str)
+    assert rewritten.count('(') - rewritten.count(')') == expression.count('(') - expression.count(')')
+
+@pytest.mark.parametrize("expression, expected", [
+    ("x^", "x^"),
+    ("x^*2", "x^*2"),
+    ("(x", "(x"),
+    ("(x^2", "(pow(x,2)"),
+    ("x^(y", "pow(x,(y)"),  # the pow is closed, the group it was given is not
+    ("x)^2", "x)^2"),
+])
+def test_malformed_rewrites(expression, expected):
+    assert rewrite_pow_expressions(expression) == expected
+
+def test_inspect_leaves_carets():
+    assert inspect_pow_expressions("pow((x,2)) + y^2") == "pow(x,2) + y^2"
+
+def test_saved_rewrites_are_capped(tmp_path):
+    location = str(tmp_path / "rewrite_cache.json")
+    cache = RewriteCache(max_size=8, max_saved=4)
+    cache.open(location)
+    for n in range(0, 6): cache.get_rewrite("x^" + str(n), rewrite_pow_expressions)
+    cache.save()
+
+    cache = RewriteCache(max_size=8, max_saved=4)
+    cache.open(location)
+    assert list(cache.saved) == ["x^2", "x^3", "x^4", "x^5"]
+    cache.get_rewrite("x^2", rewrite_pow_expressions)  # used again, so it outlives the ones after it
+    cache.get_rewrite("x^9", rewrite_pow_expressions)
+    cache.save()
+    assert list(cache.saved) == ["x^4", "x^5", "x^2", "x^9"]
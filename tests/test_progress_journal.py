@@ -0,0 +1,29 @@
+from ProgressJournal import *
+
+def test_resume_uses_the_latest_outcome(tmp_path):
+    journal = ProgressJournal(str(tmp_path / "journal.jsonl"))
+    journal.record("update_models", "Linkbot", "a/1.php", "Lesson", outcome_success, 1)
+    journal.record("update_models", "Linkbot", "b/2.php", "Lesson", outcome_no_op, 1)
+    journal.record("update_models", "Linkbot", "c/3.php", "Lesson", outcome_failure, 1, "timeout: TimeoutException()")
+    journal.record("update_models", "Linkbot", "d/4.php", "Lesson", outcome_failure, 1)
+    journal.record("update_models", "Linkbot", "d/4.php", "Lesson", outcome_success, 1)  # succeeded on a later run
+    journal.record("update_models", "Linkbot", "a/1.php", "Lesson Example 1", outcome_success, 1)
+    journal.record("update_models", "Linkbot", "a/1.php", "Lesson Example 1", outcome_failure, 1)  # failed since
+
+    assert journal.get_completed("update_models", "Linkbot") == {("a/1.php", "Lesson"), ("b/2.php", "Lesson"),
+                                                                  ("d/4.php", "Lesson")}
+
+def test_resume_is_per_action_and_info(tmp_path):
+    journal = ProgressJournal(str(tmp_path / "journal.jsonl"))
+    journal.record("update_models", "Linkbot", "a/1.php", "Lesson", outcome_success, 1)
+    assert journal.get_completed("update_models", "Linkbot-I") == set()
+    assert journal.get_completed("replace_pow_xml", "Linkbot") == set()
+
+def test_missing_journal_and_cut_short_lines(tmp_path):
+    location = tmp_path / "journal.jsonl"
+    journal = ProgressJournal(str(location))
+    assert journal.get_completed("update_models", "Linkbot") == set()
+
+    journal.record("update_models", "Linkbot", "a/1.php", "Lesson", outcome_success, 1)
+    with open(location, 'a') as journal_file: journal_file.write('{"action": "update_mod')  # a crash mid-write
+    assert journal.get_completed("update_models", "Linkbot") == {("a/1.php", "Lesson")}
@@ -0,0 +1,44 @@
+import pytest
+
+from RetryPolicy import *
+
+def test_classify_error():
+    assert classify_error(TimeoutException()) == error_timeout
+    assert classify_error(StaleElementReferenceException()) == error_stale_element
+    assert classify_error(ElementClickInterceptedException()) == error_intercepted_click
+    assert classify_error(NoSuchElementException()) == error_missing_element
+    assert classify_error(ValueError()) == error_other
+
+def test_retries_up_to_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    assert [policy.should_retry(error_timeout, attempt) for attempt in [1, 2, 3]] == [True, True, False]
+
+def test_missing_element_is_retried_once():
+    policy = RetryPolicy(max_attempts=4)
+    assert policy.should_retry(error_missing_element, 1)
+    assert not policy.should_retry(error_missing_element, 2)
+    assert not RetryPolicy(max_attempts=1).should_retry(error_missing_element, 1)
+
+def test_delay_grows_up_to_the_cap():
+    policy = RetryPolicy(base_delay=1, backoff=2, max_delay=5)
+    assert [policy.get_delay(error_timeout, attempt) for attempt in [1, 2, 3, 4, 10]] == [1, 2, 4, 5, 5]
+
+@pytest.mark.parametrize("error_class", [error_stale_element, error_intercepted_click])
+def test_timing_errors_wait_less(error_class):
+    policy = RetryPolicy(base_delay=1, backoff=2, max_delay=30)
+    assert policy.get_delay(error_class, 3) == 1
+    assert policy.get_delay(error_class, 20) == 30
+
+def test_dead_letters_persist_until_resolved(tmp_path):
+    location = str(tmp_path / "dead_letters.jsonl")
+    dead_letters = DeadLetterQueue(location)
+    dead_letters.add("update_models", "Linkbot", "a/1.php", "Lesson", error_timeout, "TimeoutException()", 4)
+    dead_letters.add("update_models", "Linkbot", "b/2.php", "Lesson Example 1", error_other, "ValueError()", 4)
+    dead_letters.add("replace_pow_xml", "draw_expr", "a/1.php", "Lesson", error_other, "ValueError()", 4)
+
+    dead_letters = DeadLetterQueue(location)
+    assert dead_letters.get_links("update_models", "Linkbot") == [("a/1.php", "Lesson"), ("b/2.php", "Lesson Example 1")]
+
+    dead_letters.resolve("update_models", "Linkbot", "a/1.php", "Lesson")
+    assert DeadLetterQueue(location).get_links("update_models", "Linkbot") == [("b/2.php", "Lesson Example 1")]
+    assert DeadLetterQueue(location).get_links("replace_pow_xml", "draw_expr") == [("a/1.php", "Lesson")]
@@ -0,0 +1,35 @@
+from WorkerPool import *
+
+def test_stopped_worker_reports_what_it_left(tmp_path):
+    progress = RunProgress(4, str(tmp_path / "results.txt"))
+    shards = [(["a/1.php", "a/1.php#2"], [["Lesson"], ["Lesson Example 1"]]), (["b/2.php", "c/3.php"], [["Lesson"], ["Lesson"]])]
+
+    def worker(worker_index, shard):
+        for link, info in zip(shard[0], shard[1]):
+            if link == "c/3.php": raise RuntimeError("browser went away")
+            progress.finish_link("", link, info, "success", 0)
+
+    def drop_shard(worker_index, shard, error):
+        left = [link for link, info in zip(shard[0], shard[1]) if not progress.is_finished(link, info[0])]
+        assert isinstance(error, RuntimeError)
+        progress.drop_links("", len(left))
+
+    run_worker_pool(shards, worker, drop_shard)
+    assert progress.completed == 3
+    assert progress.dropped == 1
+
+def test_grouping_keeps_activity_order_with_start_blocks_first():
+    links = ["a/1.php", "b/2.php", "a/1.php", "c/3.php", "b/2.php", "a/1.php"]
+    info = [["Lesson Example 1"], ["Activity Solution 2"], ["Lesson"], ["Lesson"], ["Activity"], ["Lesson Pre-Board"]]
+    grouped_links, grouped_info = group_links_by_activity(links, info)
+    assert grouped_links == ["a/1.php", "a/1.php", "a/1.php", "b/2.php", "b/2.php", "c/3.php"]
+    assert [entry[0] for entry in grouped_info] == ["Lesson", "Lesson Pre-Board", "Lesson Example 1", "Activity",
+                                                    "Activity Solution 2", "Lesson"]
+
+def test_shards_keep_activities_together():
+    links = ["a/1.php", "a/1.php#e1", "b/2.php", "c/3.php", "c/3.php?s=1", "d/4.php"]
+    info = [[str(i)] for i in range(0, len(links))]
+    shards = shard_links(links, info, 2)
+    assert shards == [(["a/1.php", "a/1.php#e1", "c/3.php", "c/3.php?s=1"], [["0"], ["1"], ["3"], ["4"]]),
+                      (["b/2.php", "d/4.php"], [["2"], ["5"]])]
+    assert len(shard_links(links, info, 10)) == 4  # no empty shards